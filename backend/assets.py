@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Subject images on local disk, addressed by the sha256 of their bytes: uploading the same
+# image twice stores it once, and a URL never changes meaning, so it can be cached forever.
+#   <root>/original/<ab>/<digest>.<ext>
+#   <root>/<variant>/<ab>/<digest>.jpg     (thumb, preview: resized JPEGs)
+# Variants are rendered in a thread pool right after ingest, or on first request.
+
+ASSET_URL_PREFIX = "/api/assets/"
+ASSET_URL_RE = re.compile(r"^/api/assets/([0-9a-f]{64})\.(jpg|png|webp|gif)$")
+# Longest side in pixels
+VARIANTS = {"thumb": 320, "preview": 1280}
+VARIANT_QUALITY = 82
+IMAGE_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+MAX_IMAGE_PIXELS = 50_000_000
+
+logger = logging.getLogger(__name__)
+
+class InvalidImage(ValueError):
+    pass
+
+class StoredAsset(NamedTuple):
+    digest: str
+    ext: str
+    url: str
+
+def asset_url(digest: str, ext: str) -> str:
+    return f"{ASSET_URL_PREFIX}{digest}.{ext}"
+
+def variant_url(digest: str, variant: str) -> str:
+    return f"{ASSET_URL_PREFIX}{digest}/{variant}.jpg"
+
+def parse_asset_url(url: str) -> Optional[Tuple[str, str]]:
+    match = ASSET_URL_RE.match(url or "")
+    return (match.group(1), match.group(2)) if match else None
+
+def thumbnail_url(url: str) -> str:
+    # External URLs are passed through unchanged
+    parsed = parse_asset_url(url)
+    return variant_url(parsed[0], "thumb") if parsed else url
+
+def write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+class AssetStore:
+    def __init__(self, root: Path, workers: int):
+        self.root = Path(root)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="assets")
+        self.pending: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    def original_path(self, digest: str, ext: str) -> Path:
+        return self.root / "original" / digest[:2] / f"{digest}.{ext}"
+
+    def variant_path(self, digest: str, variant: str) -> Path:
+        return self.root / variant / digest[:2] / f"{digest}.jpg"
+
+    async def ingest(self, data: bytes) -> StoredAsset:
+        loop = asyncio.get_running_loop()
+        ext = await loop.run_in_executor(self.executor, self.identify, data)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.original_path(digest, ext)
+        if not path.exists():
+            await loop.run_in_executor(self.executor, write_atomic, path, data)
+        for variant in VARIANTS:
+            self.schedule(digest, ext, variant)
+        return StoredAsset(digest, ext, asset_url(digest, ext))
+
+    def identify(self, data: bytes) -> str:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if image.width * image.height > MAX_IMAGE_PIXELS:
+                    raise InvalidImage("Image is too large")
+                image.verify()
+                image_format = image.format
+        except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError) as e:
+            raise InvalidImage(f"Not a valid image: {e}")
+        if image_format not in IMAGE_FORMATS:
+            raise InvalidImage(f"Unsupported image format {image_format}")
+        return IMAGE_FORMATS[image_format]
+
+    def schedule(self, digest: str, ext: str, variant: str) -> asyncio.Future:
+        # One render per (digest, variant) at a time; concurrent requests share it
+        key = (digest, variant)
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self.render, digest, ext, variant)
+            self.pending[key] = future
+            future.add_done_callback(lambda done: self.forget(key, done))
+        return future
+
+    def forget(self, key: Tuple[str, str], future: asyncio.Future):
+        self.pending.pop(key, None)
+        if not future.cancelled() and future.exception():
+            # Retried on the next request for this variant
+            logger.error("Rendering %s of asset %s failed: %r", key[1], key[0], future.exception())
+
+    def render(self, digest: str, ext: str, variant: str):
+        target = self.variant_path(digest, variant)
+        if target.exists():
+            return
+        size = VARIANTS[variant]
+        with Image.open(self.original_path(digest, ext)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                # JPEG has no alpha: flatten onto white
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=VARIANT_QUALITY, optimize=True, progressive=True)
+        write_atomic(target, buffer.getvalue())
+
+    def find_original(self, digest: str) -> Optional[Tuple[Path, str]]:
+        for ext in MEDIA_TYPES:
+            path = self.original_path(digest, ext)
+            if path.exists():
+                return path, ext
+        return None
+
+    async def variant(self, digest: str, variant: str) -> Optional[Path]:
+        path = self.variant_path(digest, variant)
+        if path.exists():
+            return path
+        original = self.find_original(digest)
+        if original is None:
+            return None
+        await self.schedule(digest, original[1], variant)
+        return path
+
+    async def read(self, path: Path) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, path.read_bytes)
@@ -0,0 +1,184 @@
+import zlib
+from typing import Optional, Sequence
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import Registry
+
+# Response compression (brotli or gzip, whichever the client prefers) for text payloads:
+# JSON listings, CSV/NDJSON exports, metrics. Small bodies go out as-is; streamed bodies
+# are compressed chunk by chunk and flushed, so downloads keep flowing. Responses that
+# already carry a Content-Encoding (precompressed cached payloads) pass through.
+
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/csv",
+    "text/plain",
+    "text/html",
+}
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Sequence[str] = ENCODINGS) -> Optional[str]:
+    # Highest q-value wins; ties go to the order of `available`
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+class StreamCompressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        self.encoding = encoding
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flushed so the client gets every chunk without waiting for the next one
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+class CompressionMetrics:
+    def __init__(self, registry: Registry):
+        self.responses = registry.counter(
+            "http_compressed_responses_total", "Responses sent compressed.", ("encoding", "source")
+        )
+        self.saved = registry.counter(
+            "http_compression_saved_bytes_total", "Response bytes saved by compression.", ("encoding", "source")
+        )
+
+    def record(self, encoding: str, source: str, original: int, compressed: int):
+        # source: "dynamic" (compressed per response) or "precompressed" (cached payloads)
+        self.responses.inc(encoding, source)
+        self.saved.inc(encoding, source, amount=original - compressed)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 metrics: Optional[CompressionMetrics] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, CompressingSender(self, encoding, send).send)
+
+class CompressingSender:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start = None
+        self.passthrough = False
+        self.stream: Optional[StreamCompressor] = None
+        self.original = 0
+        self.compressed = 0
+
+    def eligible(self, message) -> bool:
+        headers = Headers(raw=message["headers"])
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return (
+            message["status"] == 200
+            and media_type in COMPRESSIBLE_TYPES
+            and "content-encoding" not in headers
+            and "no-transform" not in headers.get("cache-control", "")
+        )
+
+    def encode_headers(self, start, length: Optional[int]):
+        headers = MutableHeaders(raw=start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+        etag = headers.get("etag")
+        if etag and etag.endswith('"'):
+            # Each encoding is its own representation
+            headers["ETag"] = f'{etag[:-1]}-{self.encoding}"'
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            self.passthrough = not self.eligible(message)
+            if self.passthrough:
+                await self.downstream(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is None and self.start is not None:
+            start, self.start = self.start, None
+            if not more_body:
+                # Whole body in one message
+                data = compress(body, self.encoding, self.level()) if len(body) >= self.middleware.minimum_size else None
+                if data is None or len(data) >= len(body):
+                    await self.downstream(start)
+                    await self.downstream(message)
+                    return
+                self.encode_headers(start, len(data))
+                await self.downstream(start)
+                await self.downstream({"type": "http.response.body", "body": data})
+                self.record(len(body), len(data))
+                return
+            self.encode_headers(start, None)
+            await self.downstream(start)
+            self.stream = StreamCompressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+
+        data = self.stream.chunk(body) if body else b""
+        if not more_body:
+            data += self.stream.finish()
+        self.original += len(body)
+        self.compressed += len(data)
+        await self.downstream({"type": "http.response.body", "body": data, "more_body": more_body})
+        if not more_body:
+            self.record(self.original, self.compressed)
+
+    def level(self) -> int:
+        return self.middleware.brotli_quality if self.encoding == "br" else self.middleware.gzip_level
+
+    def record(self, original: int, compressed: int):
+        if self.middleware.metrics:
+            self.middleware.metrics.record(self.encoding, "dynamic", original, compressed)
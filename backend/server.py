@@ -1,27 +1,94 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, Header, Depends, UploadFile, File
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, ORJSONResponse, FileResponse
 from dotenv import load_dotenv
+from starlette.datastructures import Headers
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Callable, Dict, List, Optional, NamedTuple, Tuple
 import uuid
-from datetime import datetime
+import json
+import base64
+import binascii
+import hashlib
+import hmac
+import re
+import unicodedata
+import time
+import asyncio
+import csv
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict, OrderedDict
+import anyio
 import httpx
+import orjson
 from enum import Enum
+from storage import Storage, MotorStorage, MemoryStorage, OrderFilter, ORDERS_SORT, orders_write_concern
+from assets import AssetStore, InvalidImage, VARIANTS as ASSET_VARIANTS, MEDIA_TYPES as ASSET_MEDIA_TYPES, parse_asset_url, thumbnail_url
+from metrics import Registry, MongoCommandMetrics, HTTPMetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from compression import CompressionMiddleware, CompressionMetrics, negotiate_encoding, compress, ENCODINGS as COMPRESSION_ENCODINGS
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Prometheus metrics, served on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+metrics_registry = Registry()
+mongo_metrics = MongoCommandMetrics(metrics_registry)
+
+# Response compression (brotli/gzip) for text bodies of at least COMPRESSION_MIN_SIZE bytes
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+compression_metrics = CompressionMetrics(metrics_registry)
+
+# Storage backend: "mongo" (default) or "memory" (in-process, for tests and benchmarks)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")
+# Idempotency keys expire after IDEMPOTENCY_TTL seconds
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+# Sent and failed Telegram notifications (which quote card numbers) are deleted
+# NOTIFICATION_RETENTION seconds after they settle
+NOTIFICATION_RETENTION = int(os.environ.get("NOTIFICATION_RETENTION", str(7 * 86400)))
+# Write concern for the orders collection (unset = server default): ORDERS_WRITE_W is
+# "1", "majority", ...; ORDERS_JOURNAL "true"/"false"; ORDERS_WTIMEOUT_MS bounds waiting
+# for replication
+ORDERS_WRITE_W = os.environ.get("ORDERS_WRITE_W")
+ORDERS_JOURNAL = os.environ.get("ORDERS_JOURNAL")
+ORDERS_WTIMEOUT_MS = int(os.environ["ORDERS_WTIMEOUT_MS"]) if os.environ.get("ORDERS_WTIMEOUT_MS") else None
+
+if STORAGE_BACKEND == "memory":
+    client = None
+    db = None
+    storage = MemoryStorage(idempotency_ttl=IDEMPOTENCY_TTL, notification_retention=NOTIFICATION_RETENTION)
+else:
+    # MongoDB connection
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_metrics] if METRICS_ENABLED else [])
+    db = client[os.environ['DB_NAME']]
+    storage = MotorStorage(
+        db, idempotency_ttl=IDEMPOTENCY_TTL, notification_retention=NOTIFICATION_RETENTION,
+        orders_write_concern=orders_write_concern(
+            ORDERS_WRITE_W, None if ORDERS_JOURNAL is None else ORDERS_JOURNAL.lower() == "true", ORDERS_WTIMEOUT_MS,
+        ),
+    )
+
+def get_storage() -> Storage:
+    return storage
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+def app_storage() -> Storage:
+    # The store the routes get, so code outside routes follows dependency_overrides (tests)
+    return app.dependency_overrides.get(get_storage, get_storage)()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -44,17 +111,6 @@ class PurchaseType(str, Enum):
 
 # Models
 
-# Telegram helper
-async def send_telegram_message(token: str, chat_id: str, text: str):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(url, json=payload)
-    except Exception:
-        # لا نوقف الطلب في حال فشل الإشعار
-        pass
-
 class Subject(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -84,6 +140,22 @@ class Order(BaseModel):
     status: OrderStatus = OrderStatus.PENDING
     created_at: datetime = Field(default_factory=datetime.utcnow)
     confirmed_at: Optional[datetime] = None
+    card_numbers_masked: List[str] = []
+    suspected_duplicate: bool = False
+    duplicate_of: List[str] = []  # Order IDs that already used one of these cards
+
+class OrderSummary(BaseModel):
+    id: str
+    student_name: str
+    contact_method: Optional[str] = None
+    contact_value: Optional[str] = None
+    grade: str
+    purchase_type: str
+    selected_subjects: List[str] = []
+    total_amount: int
+    status: str
+    created_at: datetime
+    confirmed_at: Optional[datetime] = None
 
 class OrderCreateFlex(BaseModel):
     student_name: str
@@ -103,6 +175,21 @@ class OrderUpdate(BaseModel):
     status: OrderStatus
     admin_notes: Optional[str] = None
 
+# Read paths fetch only response fields and return stored documents as-is (they were
+# validated on the way in), skipping per-row model construction.
+ORDER_PROJECTION = {"_id": 0, **{field: 1 for field in Order.model_fields}}
+# Listings show masked cards only; the full numbers are on GET /orders/{order_id}
+ORDER_LIST_PROJECTION = {"_id": 0, **{field: 1 for field in Order.model_fields if field != "card_numbers"}}
+SUBJECT_PROJECTION = {"_id": 0, **{field: 1 for field in Subject.model_fields}}
+
+ORDERS_BULK_MAX = 500
+
+class OrderBulkRequest(BaseModel):
+    order_ids: List[str] = Field(..., min_length=1, max_length=ORDERS_BULK_MAX)
+    status: Optional[OrderStatus] = None
+    delete: bool = False
+    admin_notes: Optional[str] = None
+
 # Default subjects for each grade
 DEFAULT_SUBJECTS = {
     GradeType.SIXTH_PRIMARY: [
@@ -123,55 +210,1161 @@ DEFAULT_SUBJECTS = {
     ]
 }
 
+# Seed version is derived from DEFAULT_SUBJECTS, so editing the list triggers a reseed
+SUBJECTS_SEED_VERSION = hashlib.sha256(
+    json.dumps({grade.value: names for grade, names in DEFAULT_SUBJECTS.items()}, ensure_ascii=False).encode()
+).hexdigest()
+
 # Initialize default subjects
-async def init_default_subjects():
-    # Clear existing subjects first
-    await db.subjects.delete_many({})
-    
-    # Add new subjects according to the updated structure
-    for grade, subjects in DEFAULT_SUBJECTS.items():
-        for subject_name in subjects:
-            subject = Subject(name=subject_name, grade=grade)
-            await db.subjects.insert_one(subject.dict())
+async def init_default_subjects(store: Storage):
+    seed = await store.meta.get("subjects_seed")
+    if seed and seed.get("version") == SUBJECTS_SEED_VERSION:
+        return
+
+    # Upserted on (grade, name) so existing subjects keep their ids; previously seeded
+    # subjects that are no longer in the defaults are dropped
+    await store.subjects.seed([
+        {**Subject(name=subject_name, grade=grade).dict(), "grade": grade.value}
+        for grade, subjects in DEFAULT_SUBJECTS.items()
+        for subject_name in subjects
+    ])
+    await store.meta.set("subjects_seed", {"version": SUBJECTS_SEED_VERSION, "seeded_at": datetime.utcnow()})
+    await catalog_cache.invalidate(store)
+    logger.info("Seeded default subjects (version %s)", SUBJECTS_SEED_VERSION[:12])
+
+# Telegram notifications go through a persistent outbox (storage.notifications) drained by a
+# background worker, so order requests never wait on the Telegram API.
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") or "6184834915:AAHB4TZr_O5_djf1HcZl7cZPtDEsGUKAdXQ"
+TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID") or "981403292"
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))
+# Telegram allows roughly one message per second into a single chat
+TELEGRAM_MIN_INTERVAL = float(os.environ.get("TELEGRAM_MIN_INTERVAL", "1"))
+OUTBOX_BACKOFF_BASE = 2.0
+OUTBOX_BACKOFF_MAX = 300.0
+OUTBOX_LEASE = 60.0
+
+telegram_send_duration = metrics_registry.histogram(
+    "telegram_send_duration_seconds", "Telegram Bot API round-trip time.", ("method",)
+)
+telegram_sends = metrics_registry.counter(
+    "telegram_sends_total", "Telegram send attempts by outcome.", ("method", "result")
+)
+
+class NotificationStatus(str, Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+def format_order_message(order: dict) -> str:
+    cards_text = "\n".join([f"• {c}" for c in (order.get("card_numbers") or [])]) or "—"
+    kind_text = "جميع المواد" if order.get("purchase_type") == "all" else f"مواد منفردة ({len(order.get('selected_subjects') or [])})"
+    return (
+        "طلب جديد ✅\n"
+        f"الطالب: {order.get('student_name','')}\n"
+        f"الصف: {stat_value(order.get('grade', ''))}\n"
+        f"النوع: {kind_text}\n"
+        f"المبلغ: ${order.get('total_amount','')}\n"
+        f"التواصل: {order.get('contact_method','') or ''} {order.get('contact_value','') or ''}\n"
+        f"الكروت:\n{cards_text}\n"
+        f"رقم الطلب: {order.get('id','')}"
+    )
+
+async def enqueue_telegram_message(store: Storage, text: str, chat_id: Optional[str] = None):
+    now = datetime.utcnow()
+    await store.notifications.insert({
+        "id": str(uuid.uuid4()),
+        "chat_id": chat_id or TELEGRAM_CHAT_ID,
+        "text": text,
+        "status": NotificationStatus.PENDING.value,
+        "attempts": 0,
+        "last_error": None,
+        "next_attempt_at": now,
+        "created_at": now,
+        "sent_at": None,
+        "completed_at": None,
+    })
+    telegram_outbox.wake()
+
+# Background workers: start() runs `concurrency` loops, each doing a round of work and then
+# sleeping until wake() or the poll interval; stop() ends them.
+def retry_backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_BASE ** attempts, OUTBOX_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+class BackgroundWorker:
+    name = "Background worker"
+
+    def __init__(self, poll_interval: float = OUTBOX_POLL_INTERVAL, concurrency: int = 1):
+        self.poll_interval = poll_interval
+        self.concurrency = concurrency
+        self.store: Optional[Storage] = None
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+
+    def wake(self):
+        self.wakeup.set()
+
+    async def start(self, store: Storage):
+        # Bound to the running loop, so the app can be started more than once (tests)
+        self.store = store
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        await self.open()
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # The flag also ends a loop whose cancellation was swallowed by a wait_for that
+        # finished at the same moment (asyncio before Python 3.12)
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.close()
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s error", self.name)
+            if self.stopping:
+                break
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+class TelegramWorker(BackgroundWorker):
+    # One pooled client for the lifetime of the worker (keeps the TLS connection alive)
+    def __init__(self, api_url: str, token: str, timeout: float, connections: int, concurrency: int = 1,
+                 min_interval: float = TELEGRAM_MIN_INTERVAL):
+        super().__init__(concurrency=concurrency)
+        self.api_url = api_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.connections = connections
+        self.min_interval = min_interval
+        self.http: Optional[httpx.AsyncClient] = None
+        self.paused_until = 0.0
+
+    async def open(self):
+        self.http = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=self.connections, max_keepalive_connections=self.connections),
+        )
+
+    async def close(self):
+        if self.http:
+            await self.http.aclose()
+            self.http = None
+
+    async def run_once(self):
+        while await self.process_next():
+            pass
+
+    async def process_next(self) -> bool:
+        raise NotImplementedError
+
+class TelegramOutbox(TelegramWorker):
+    name = "Telegram outbox worker"
+
+    def __init__(self, api_url: str, token: str, min_interval: float = TELEGRAM_MIN_INTERVAL):
+        super().__init__(api_url, token, timeout=10.0, connections=4, min_interval=min_interval)
+        self.last_sent = 0.0
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        # Pending and due, or left in "sending" by a worker that died mid-send
+        return await self.store.notifications.claim_due(now, now + timedelta(seconds=OUTBOX_LEASE))
+
+    async def throttle(self):
+        delay = max(self.paused_until, self.last_sent + self.min_interval) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def process_next(self) -> bool:
+        notification = await self.claim()
+        if not notification:
+            return False
+
+        await self.throttle()
+        started = time.perf_counter()
+        try:
+            response = await self.http.post(
+                f"/bot{self.token}/sendMessage",
+                json={"chat_id": notification["chat_id"], "text": notification["text"]},
+            )
+        except httpx.HTTPError as e:
+            telegram_sends.inc("sendMessage", "network_error")
+            await self.reschedule(notification, repr(e))
+            return True
+        finally:
+            self.last_sent = time.monotonic()
+            telegram_send_duration.observe(time.perf_counter() - started, "sendMessage")
+
+        telegram_sends.inc("sendMessage", telegram_send_result(response.status_code))
+        if response.status_code == 200:
+            now = datetime.utcnow()
+            await self.store.notifications.update(
+                notification["id"],
+                {"status": NotificationStatus.SENT.value, "sent_at": now, "completed_at": now, "last_error": None},
+            )
+        elif response.status_code == 429:
+            # Rate limited: pause the whole worker and retry without spending an attempt
+            retry_after = telegram_retry_after(response)
+            self.paused_until = time.monotonic() + retry_after
+            await self.store.notifications.update(notification["id"], {
+                "status": NotificationStatus.PENDING.value,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=retry_after),
+                "last_error": "429 Too Many Requests",
+            })
+        elif response.status_code >= 500:
+            await self.reschedule(notification, f"{response.status_code} {response.text[:200]}")
+        else:
+            # Other 4xx (bad token, unknown chat, ...) will not succeed on retry
+            await self.store.notifications.update(notification["id"], {
+                "status": NotificationStatus.FAILED.value,
+                "completed_at": datetime.utcnow(),
+                "attempts": notification.get("attempts", 0) + 1,
+                "last_error": f"{response.status_code} {response.text[:200]}",
+            })
+            logger.error("Telegram notification %s rejected: %s", notification["id"], response.status_code)
+        return True
+
+    async def reschedule(self, notification: dict, error: str):
+        attempts = notification.get("attempts", 0) + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update = {"status": NotificationStatus.FAILED.value, "completed_at": datetime.utcnow()}
+            logger.error("Telegram notification %s failed after %d attempts: %s", notification["id"], attempts, error)
+        else:
+            backoff = retry_backoff(attempts)
+            update = {
+                "status": NotificationStatus.PENDING.value,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff),
+            }
+        update.update({"attempts": attempts, "last_error": error})
+        await self.store.notifications.update(notification["id"], update)
+
+def telegram_send_result(status_code: int) -> str:
+    if status_code == 200:
+        return "sent"
+    if status_code == 429:
+        return "rate_limited"
+    return "server_error" if status_code >= 500 else "rejected"
+
+def telegram_retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return float(response.headers.get("retry-after") or 5)
+
+telegram_outbox = TelegramOutbox(TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN)
+
+# Fulfillment: when an order is confirmed, a job in storage.fulfillments sends the images of
+# the purchased subjects as Telegram media groups. Progress (sent batches) is saved after
+# every batch and jobs are leased, so a restarted worker resumes where the last one stopped;
+# a crash between a send and its progress write re-sends that one batch.
+FULFILLMENT_ENABLED = os.environ.get("FULFILLMENT_ENABLED", "true").lower() == "true"
+FULFILLMENT_CONCURRENCY = int(os.environ.get("FULFILLMENT_CONCURRENCY", "2"))
+# Orders whose contact isn't a numeric Telegram chat id are delivered here for forwarding
+FULFILLMENT_CHAT_ID = os.environ.get("FULFILLMENT_CHAT_ID") or TELEGRAM_CHAT_ID
+FULFILLMENT_MAX_ATTEMPTS = int(os.environ.get("FULFILLMENT_MAX_ATTEMPTS", "8"))
+FULFILLMENT_LEASE = 120.0
+MEDIA_GROUP_MAX = 10  # Telegram's limit per sendMediaGroup
+
+class FulfillmentStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+def fulfillment_chat_id(order: dict) -> str:
+    contact = (order.get("contact_value") or "").strip()
+    if order.get("contact_method") == "telegram" and contact.lstrip("-").isdigit():
+        return contact
+    return FULFILLMENT_CHAT_ID
+
+def plan_fulfillment_batches(order: dict, subjects: List[dict]) -> List[dict]:
+    # One caption per subject; a subject's images are split into media groups of up to 10
+    if order.get("purchase_type") != PurchaseType.ALL_SUBJECTS.value:
+        selected = set(order.get("selected_subjects") or [])
+        subjects = [subject for subject in subjects if subject["id"] in selected]
+    batches = []
+    for subject in subjects:
+        urls = subject.get("image_urls") or []
+        for start in range(0, len(urls), MEDIA_GROUP_MAX):
+            batches.append({
+                "caption": f"{subject['name']} - {order.get('student_name', '')} ({order['id'][:8]})",
+                "urls": urls[start:start + MEDIA_GROUP_MAX],
+            })
+    return batches
+
+def fulfillment_job(order_id: str, chat_id: str, now: datetime) -> dict:
+    return {
+        "order_id": order_id,
+        "chat_id": chat_id,
+        "status": FulfillmentStatus.PENDING.value,
+        "batches": None,  # planned by the worker, then fixed for the life of the job
+        "sent_batches": 0,
+        "attempts": 0,
+        "last_error": None,
+        "next_attempt_at": now,
+        "created_at": now,
+        "completed_at": None,
+    }
+
+async def enqueue_fulfillment(store: Storage, order_id: str, chat_id: str):
+    if not FULFILLMENT_ENABLED:
+        return
+    if await store.fulfillments.create(fulfillment_job(order_id, chat_id, datetime.utcnow())):
+        fulfillment_worker.wake()
+
+async def enqueue_fulfillments(store: Storage, targets: List[Tuple[str, str]]):
+    # Bulk confirmation: one write for all (order_id, chat_id) pairs
+    if not FULFILLMENT_ENABLED or not targets:
+        return
+    now = datetime.utcnow()
+    if await store.fulfillments.create_many([fulfillment_job(order_id, chat_id, now) for order_id, chat_id in targets]):
+        fulfillment_worker.wake()
+
+class FulfillmentWorker(TelegramWorker):
+    name = "Fulfillment worker"
+
+    def __init__(self, api_url: str, token: str, concurrency: int, min_interval: float = TELEGRAM_MIN_INTERVAL):
+        super().__init__(api_url, token, timeout=30.0, connections=concurrency, concurrency=concurrency,
+                         min_interval=min_interval)
+        self.last_sent = {}  # chat id -> monotonic time of the last send
+
+    def lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=FULFILLMENT_LEASE)
+
+    async def process_next(self) -> bool:
+        job = await self.store.fulfillments.claim_due(datetime.utcnow(), self.lease())
+        if not job:
+            return False
+
+        batches = job.get("batches")
+        if batches is None:
+            order = await self.store.orders.get(job["order_id"], include_archived=True)
+            if order is None:
+                await self.finish(job, FulfillmentStatus.FAILED, "Order not found")
+                return True
+            subjects = await self.store.subjects.list_by_grade(order.get("grade"), SUBJECT_PROJECTION)
+            batches = plan_fulfillment_batches(order, subjects)
+            await self.store.fulfillments.update(job["order_id"], {"batches": batches})
+
+        for index in range(job.get("sent_batches", 0), len(batches)):
+            error, retry_after, retryable = await self.send_batch(job["chat_id"], batches[index])
+            if error:
+                await self.reschedule(job, error, retry_after, retryable)
+                return True
+            # Progress plus a fresh lease, so a long order isn't picked up by another worker
+            await self.store.fulfillments.update(job["order_id"], {"sent_batches": index + 1, "next_attempt_at": self.lease()})
+
+        await self.finish(job, FulfillmentStatus.DONE)
+        return True
+
+    async def throttle(self, chat_id: str):
+        delay = max(self.paused_until, self.last_sent.get(chat_id, 0.0) + self.min_interval) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.last_sent[chat_id] = time.monotonic()
+
+    async def photo_source(self, url: str, files: dict) -> str:
+        # Local assets are uploaded once (as the preview variant) and then sent by the
+        # file_id Telegram returned; other URLs are fetched by Telegram itself
+        parsed = parse_asset_url(url)
+        if not parsed:
+            return url
+        cached = await self.store.meta.get(f"telegram_file:{parsed[0]}")
+        if cached:
+            return cached["file_id"]
+        path = await asset_store.variant(parsed[0], "preview")
+        if path is None:
+            return url
+        name = f"photo{len(files)}"
+        files[name] = (f"{parsed[0]}.jpg", await asset_store.read(path), "image/jpeg")
+        return f"attach://{name}"
+
+    async def remember_file_ids(self, urls: List[str], sources: List[str], response: httpx.Response):
+        try:
+            messages = response.json()["result"]
+        except (ValueError, KeyError):
+            return
+        if isinstance(messages, dict):
+            messages = [messages]
+        for url, source, message in zip(urls, sources, messages):
+            photo = message.get("photo") if isinstance(message, dict) else None
+            if source.startswith("attach://") and photo:
+                # Largest size last
+                await self.store.meta.set(f"telegram_file:{parse_asset_url(url)[0]}", {"file_id": photo[-1]["file_id"]})
+
+    async def send_batch(self, chat_id: str, batch: dict) -> Tuple[Optional[str], float, bool]:
+        # Returns (error, retry_after, retryable); error is None on success
+        urls = batch["urls"]
+        files = {}
+        sources = [await self.photo_source(url, files) for url in urls]
+        if len(urls) == 1:
+            method = "sendPhoto"
+            payload = {"chat_id": chat_id, "caption": batch["caption"]}
+            if files:
+                # sendPhoto takes the upload as the "photo" part, not attach://
+                files = {"photo": files.popitem()[1]}
+            else:
+                payload["photo"] = sources[0]
+        else:
+            method = "sendMediaGroup"
+            media = [{"type": "photo", "media": source} for source in sources]
+            media[0]["caption"] = batch["caption"]
+            payload = {"chat_id": chat_id, "media": media}
+
+        await self.throttle(chat_id)
+        started = time.perf_counter()
+        try:
+            if files:
+                form = {key: value if isinstance(value, str) else json.dumps(value) for key, value in payload.items()}
+                response = await self.http.post(f"/bot{self.token}/{method}", data=form, files=files)
+            else:
+                response = await self.http.post(f"/bot{self.token}/{method}", json=payload)
+        except httpx.HTTPError as e:
+            telegram_sends.inc(method, "network_error")
+            return repr(e), 0.0, True
+        finally:
+            telegram_send_duration.observe(time.perf_counter() - started, method)
+
+        telegram_sends.inc(method, telegram_send_result(response.status_code))
+        if response.status_code == 200:
+            await self.remember_file_ids(urls, sources, response)
+            return None, 0.0, False
+        error = f"{response.status_code} {response.text[:200]}"
+        if response.status_code == 429:
+            retry_after = telegram_retry_after(response)
+            self.paused_until = time.monotonic() + retry_after
+            return error, retry_after, True
+        return error, 0.0, response.status_code >= 500
+
+    async def reschedule(self, job: dict, error: str, retry_after: float, retryable: bool):
+        if retry_after:
+            # Rate limited: retry without spending an attempt
+            await self.store.fulfillments.update(job["order_id"], {
+                "status": FulfillmentStatus.PENDING.value,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=retry_after),
+                "last_error": error,
+            })
+            return
+        attempts = job.get("attempts", 0) + 1
+        if not retryable or attempts >= FULFILLMENT_MAX_ATTEMPTS:
+            await self.finish({**job, "attempts": attempts}, FulfillmentStatus.FAILED, error)
+            return
+        backoff = retry_backoff(attempts)
+        await self.store.fulfillments.update(job["order_id"], {
+            "status": FulfillmentStatus.PENDING.value,
+            "attempts": attempts,
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff),
+            "last_error": error,
+        })
+
+    async def finish(self, job: dict, status: FulfillmentStatus, error: Optional[str] = None):
+        await self.store.fulfillments.update(job["order_id"], {
+            "status": status.value,
+            "attempts": job.get("attempts", 0),
+            "last_error": error,
+            "completed_at": datetime.utcnow(),
+        })
+        if status == FulfillmentStatus.FAILED:
+            logger.error("Fulfillment of order %s failed: %s", job["order_id"], error)
+
+fulfillment_worker = FulfillmentWorker(TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN, FULFILLMENT_CONCURRENCY)
+
+# Live order events: an in-process pub/sub hub feeding the /orders/stream SSE endpoint.
+# With several workers set ORDER_EVENTS_SOURCE=changestream so every worker publishes
+# from a Mongo change stream (requires a replica set and the mongo storage backend)
+# instead of its own handlers.
+ORDER_EVENTS_SOURCE = os.environ.get("ORDER_EVENTS_SOURCE", "local")
+ORDER_EVENTS_QUEUE_SIZE = 100
+SSE_HEARTBEAT_INTERVAL = 15.0
+
+class OrderEventHub:
+    def __init__(self):
+        self.subscribers = set()
+        self.sequence = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=ORDER_EVENTS_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict):
+        self.sequence += 1
+        message = (
+            f"id: {self.sequence}\n"
+            f"event: {event}\n"
+            f"data: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+        )
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than block publishers
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def publish_local(self, event: str, data: dict):
+        # Handlers publish only when the change stream isn't doing it for us
+        if ORDER_EVENTS_SOURCE == "local":
+            self.publish(event, data)
+
+    async def watch_changes(self, store: MotorStorage):
+        resume_token = None
+        while True:
+            try:
+                async with store.db.orders.watch(
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=resume_token,
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.publish_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Order change stream failed, retrying")
+                await asyncio.sleep(5)
+
+    def publish_change(self, change: dict):
+        operation = change["operationType"]
+        document = change.get("fullDocument") or {}
+        # Subscribers get what the admin listing shows, never card numbers or lookup keys
+        if operation == "insert":
+            self.publish("order_created", listed_order(document))
+        elif operation in ("update", "replace") and document:
+            updated = change.get("updateDescription", {}).get("updatedFields")
+            if updated is None:
+                updated = listed_order(document)
+            else:
+                # Paths like "card_numbers.0" are filtered by their top-level field
+                updated = {path: value for path, value in updated.items() if path.split(".")[0] in ORDER_LIST_PROJECTION and path != "_id"}
+            self.publish("order_updated", {**updated, "id": document.get("id")})
+        elif operation == "delete":
+            # The order id is only known when the collection has pre-images enabled
+            before = change.get("fullDocumentBeforeChange") or {}
+            if before.get("id"):
+                self.publish("order_deleted", {"id": before["id"]})
+
+order_events = OrderEventHub()
+
+# Sales statistics: counters maintained incrementally on every order write, so
+# GET /api/stats never scans orders. rebuild_order_stats() recomputes them from scratch.
+STATS_FIELDS = {"_id": 0, "grade": 1, "status": 1, "purchase_type": 1, "created_at": 1, "total_amount": 1}
+STATS_DIMENSIONS = ("grade", "status", "purchase_type", "day")
+STATS_DAYS_DEFAULT = 30
+
+def stat_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+def order_stat_keys(order: dict) -> List[Tuple[str, str]]:
+    created_at = order.get("created_at")
+    return [
+        ("total", "all"),
+        ("grade", stat_value(order.get("grade"))),
+        ("status", stat_value(order.get("status"))),
+        ("purchase_type", stat_value(order.get("purchase_type"))),
+        ("day", created_at.strftime("%Y-%m-%d") if created_at else None),
+    ]
+
+async def record_order_stats(store: Storage, changes: List[Tuple[dict, int]]):
+    # changes: (order, +1 | -1); a status change is (old, -1) + (new, +1) and nets out elsewhere
+    deltas = defaultdict(lambda: [0, 0])
+    for order, sign in changes:
+        for dimension, key in order_stat_keys(order):
+            delta = deltas[(dimension, key)]
+            delta[0] += sign
+            delta[1] += sign * (order.get("total_amount") or 0)
+
+    deltas = {stat_key: tuple(delta) for stat_key, delta in deltas.items() if delta[0] or delta[1]}
+    if deltas:
+        try:
+            await store.orders.apply_stats(deltas)
+        except Exception:
+            # Counters are derived data; a rebuild fixes any drift
+            logger.exception("Failed to update order statistics")
+
+async def rebuild_order_stats(store: Storage) -> int:
+    return await store.orders.rebuild_stats(order_stat_keys)
+
+# Archival: confirmed and rejected orders settled more than ARCHIVE_AFTER_DAYS ago are
+# moved to the orders_archive collection in small batches, keeping the hot collection
+# (and its indexes) down to the working set. Single-order reads and writes fall back to
+# the archive; listings and exports include it with include_archived=true.
+ARCHIVE_ENABLED = os.environ.get("ARCHIVE_ENABLED", "true").lower() == "true"
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "3600"))
+# Pause between batches so a large first run doesn't compete with live traffic
+ARCHIVE_BATCH_PAUSE = float(os.environ.get("ARCHIVE_BATCH_PAUSE", "1"))
+SETTLED_STATUSES = [OrderStatus.CONFIRMED.value, OrderStatus.REJECTED.value]
+
+orders_archived = metrics_registry.counter("orders_archived_total", "Orders moved to the archive collection.")
+
+async def archive_settled_orders(store: Storage) -> int:
+    before = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while True:
+        moved = await store.orders.archive(SETTLED_STATUSES, before, ARCHIVE_BATCH_SIZE)
+        archived += moved
+        orders_archived.inc(amount=moved)
+        if moved < ARCHIVE_BATCH_SIZE:
+            return archived
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+
+class OrderArchiver(BackgroundWorker):
+    # Safe to run in every worker: archiving an order twice is a no-op
+    name = "Order archiver"
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL):
+        super().__init__(poll_interval=interval)
+
+    async def run_once(self):
+        archived = await archive_settled_orders(self.store)
+        if archived:
+            logger.info("Archived %d settled orders", archived)
+
+order_archiver = OrderArchiver()
+
+# Admission control for public order POSTs: token buckets (kept in a bounded LRU) plus a
+# global in-flight limit. Requests over the limits are shed immediately with 429/503
+# instead of queueing on Mongo. A returning client pays from its client_key bucket;
+# requests without a client_key, or with one not seen before (a bot rotating keys), also
+# pay from the bucket of their address. A submission is charged once per Idempotency-Key:
+# the checkout's fallback attempts and retries of an order that was already stored pass
+# without a token.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", "0.2"))  # tokens per second
+ADMISSION_BURST = float(os.environ.get("ADMISSION_BURST", "5"))
+# Address buckets: per client IP when ADMISSION_PROXY_HOPS is set, otherwise one bucket
+# shared by everyone behind the proxy, so the defaults are sized for the whole site
+ADMISSION_IP_RATE = float(os.environ.get("ADMISSION_IP_RATE", "1"))
+ADMISSION_IP_BURST = float(os.environ.get("ADMISSION_IP_BURST", "20"))
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", "10000"))
+ADMISSION_MAX_INFLIGHT = int(os.environ.get("ADMISSION_MAX_INFLIGHT", "50"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "2"))
+# Number of trusted proxies appending to X-Forwarded-For (0 = use the socket peer)
+ADMISSION_PROXY_HOPS = int(os.environ.get("ADMISSION_PROXY_HOPS", "0"))
+# Charge the address bucket on every request, not only for unknown clients (on by default
+# once the hops are configured, or ADMISSION_BY_IP=true for a server reached directly)
+ADMISSION_BY_IP = os.environ.get("ADMISSION_BY_IP", "true" if ADMISSION_PROXY_HOPS else "false").lower() == "true"
+# Path -> largest accepted body
+ADMISSION_PATHS = {"/api/orders": 64 * 1024, "/api/orders/simple": 64 * 1024, "/api/orders/batch": 1024 * 1024}
+
+class AdmissionController:
+    def __init__(self):
+        self.buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self.charged_keys = OrderedDict()  # Idempotency-Key -> charged_at
+        self.inflight = asyncio.Semaphore(ADMISSION_MAX_INFLIGHT)
+        self.counters = {"admitted": 0, "shed_rate_limited": 0, "shed_overloaded": 0}
+        self.active = 0
+
+    def take_token(self, keys: List[str]) -> float:
+        # Admits only if every bucket has a token; otherwise returns seconds until it would
+        now = time.monotonic()
+        buckets = []
+        for key in keys:
+            rate, burst = bucket_limits(key)
+            bucket = self.buckets.pop(key, None)
+            known = bucket is not None
+            bucket = bucket or [burst, now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if known:
+                self.buckets[key] = bucket
+            buckets.append((key, bucket, rate))
+
+        wait = max((1 - bucket[0]) / rate for _, bucket, rate in buckets)
+        # A refused client isn't remembered, so a new client_key stays new until admitted
+        if wait <= 0:
+            for key, bucket, _ in buckets:
+                bucket[0] -= 1
+                self.buckets[key] = bucket
+        while len(self.buckets) > ADMISSION_MAX_CLIENTS:
+            self.buckets.popitem(last=False)
+        return max(wait, 0.0)
+
+    def bucket_keys(self, ip: str, client_key: Optional[str]) -> List[str]:
+        keys = [f"ck:{client_key}"] if client_key else []
+        if ADMISSION_BY_IP or not keys or keys[0] not in self.buckets:
+            keys.append(f"ip:{ip}")
+        return keys
+
+    def charged(self, idempotency_key: str) -> bool:
+        charged_at = self.charged_keys.get(idempotency_key)
+        return charged_at is not None and time.monotonic() - charged_at < IDEMPOTENCY_TTL
+
+    def remember_charge(self, idempotency_key: str):
+        self.charged_keys.pop(idempotency_key, None)
+        self.charged_keys[idempotency_key] = time.monotonic()
+        while len(self.charged_keys) > ADMISSION_MAX_CLIENTS:
+            self.charged_keys.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": self.active, "tracked_clients": len(self.buckets)}
+
+admission = AdmissionController()
+metrics_registry.callback(
+    "admission_requests_total", "Order POSTs by admission outcome.", ("outcome",),
+    lambda: {(outcome,): count for outcome, count in admission.counters.items()}, kind="counter",
+)
+metrics_registry.callback(
+    "admission_in_flight", "Admitted order POSTs currently being served.", (),
+    lambda: {(): admission.active},
+)
+
+def bucket_limits(key: str) -> Tuple[float, float]:
+    # (tokens per second, burst)
+    if key.startswith("ip:"):
+        return ADMISSION_IP_RATE, ADMISSION_IP_BURST
+    return ADMISSION_RATE, ADMISSION_BURST
+
+def client_ip(scope) -> str:
+    if ADMISSION_PROXY_HOPS:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                hops = [hop.strip() for hop in value.decode("latin-1").split(",")]
+                return hops[-min(ADMISSION_PROXY_HOPS, len(hops))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, controller: AdmissionController, store: Callable[[], Storage]):
+        self.app = app
+        self.controller = controller
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if not (ADMISSION_ENABLED and scope["type"] == "http" and scope["method"] == "POST"
+                and scope["path"] in ADMISSION_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        # Buffer the (small) body to find client_key, then replay it downstream
+        max_body = ADMISSION_PATHS[scope["path"]]
+        body = b""
+        more_body = True
+        while more_body and len(body) <= max_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        if more_body or len(body) > max_body:
+            await self.reject(send, 413, "Request body too large")
+            return
+
+        client_key = None
+        try:
+            payload = orjson.loads(body) if body else {}
+            if isinstance(payload, dict) and payload.get("client_key"):
+                client_key = str(payload["client_key"])
+        except orjson.JSONDecodeError:
+            pass
+        idempotency_key = Headers(scope=scope).get("idempotency-key")
+        if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            idempotency_key = None
+        if not (idempotency_key and self.controller.charged(idempotency_key)):
+            retry_after = self.controller.take_token(self.controller.bucket_keys(client_ip(scope), client_key))
+            # Only a refused request costs a store lookup: a retry of an order another
+            # worker stored is still let through
+            if retry_after and not (idempotency_key and await self.store().orders.idempotency_key_claimed(idempotency_key)):
+                self.controller.counters["shed_rate_limited"] += 1
+                await self.reject(send, 429, "Too many orders, please retry later", retry_after)
+                return
+            if idempotency_key:
+                self.controller.remember_charge(idempotency_key)
+
+        try:
+            await asyncio.wait_for(self.controller.inflight.acquire(), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.controller.counters["shed_overloaded"] += 1
+            await self.reject(send, 503, "Server busy, please retry", ADMISSION_QUEUE_TIMEOUT)
+            return
+
+        self.controller.counters["admitted"] += 1
+        self.controller.active += 1
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            self.controller.active -= 1
+            self.controller.inflight.release()
+
+    async def reject(self, send, status_code: int, detail: str, retry_after: float = 0):
+        headers = {"Retry-After": str(max(1, int(retry_after + 0.999)))} if retry_after else None
+        response = ORJSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+        await send({"type": "http.response.start", "status": response.status_code, "headers": response.raw_headers})
+        await send({"type": "http.response.body", "body": response.body})
+
+# Catalog cache: subjects per grade served from memory with strong ETags.
+# Writers bump a version counter in storage.meta; other workers notice it within CATALOG_CACHE_TTL.
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", "5"))
+
+class CachedJSON(NamedTuple):
+    body: bytes
+    etag: str
+    # Compressed once per encoding, served to clients accepting it
+    encoded: Dict[str, bytes] = {}
+
+def cached_json(data) -> CachedJSON:
+    body = orjson.dumps(data)
+    encoded = {}
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        # Max compression: it's paid once, not per request
+        encoded = {encoding: compress(body, encoding) for encoding in COMPRESSION_ENCODINGS}
+        encoded = {encoding: data for encoding, data in encoded.items() if len(data) < len(body)}
+    return CachedJSON(body, '"%s"' % hashlib.sha256(body).hexdigest()[:32], encoded)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def cached_json_response(request: Request, payload: CachedJSON) -> Response:
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache"}
+    body = payload.body
+    encoding = None
+    if payload.encoded:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), tuple(payload.encoded))
+        if encoding:
+            # Each encoding is its own representation, so it gets its own ETag
+            headers["ETag"] = f'{payload.etag[:-1]}-{encoding}"'
+            headers["Content-Encoding"] = encoding
+            body = payload.encoded[encoding]
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        compression_metrics.record(encoding, "precompressed", len(payload.body), len(body))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def catalog_subject(subject: dict) -> dict:
+    return {**subject, "thumbnail_urls": [thumbnail_url(url) for url in subject.get("image_urls") or []]}
+
+class CatalogCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = None
+        self.checked_at = 0.0
+        self.subjects = {}
+        self.catalog: Optional[CachedJSON] = None
+
+    async def current_version(self, store: Storage) -> int:
+        now = time.monotonic()
+        if self.version is None or now - self.checked_at >= self.ttl:
+            doc = await store.meta.get("catalog_version")
+            version = doc["version"] if doc else 0
+            if version != self.version:
+                self.subjects.clear()
+                self.catalog = None
+                self.version = version
+            self.checked_at = now
+        return self.version
+
+    async def get_subjects(self, store: Storage, grade: str) -> CachedJSON:
+        version = await self.current_version(store)
+        payload = self.subjects.get(grade)
+        if payload is None:
+            subjects = await store.subjects.list_by_grade(grade, SUBJECT_PROJECTION)
+            payload = cached_json([catalog_subject(subject) for subject in subjects])
+            # Don't store a payload read while another request invalidated the cache
+            if version == self.version:
+                self.subjects[grade] = payload
+        return payload
+
+    async def get_catalog(self, store: Storage) -> CachedJSON:
+        version = await self.current_version(store)
+        payload = self.catalog
+        if payload is None:
+            subjects = await asyncio.gather(*[
+                store.subjects.list_by_grade(grade["value"], SUBJECT_PROJECTION) for grade in GRADES_DATA["grades"]
+            ])
+            catalog = {
+                "grades": [
+                    {**grade, "subjects": [catalog_subject(subject) for subject in grade_subjects]}
+                    for grade, grade_subjects in zip(GRADES_DATA["grades"], subjects)
+                ],
+                "pricing": PRICING_DATA,
+            }
+            # Content hash in the body too: clients can key a local copy on it (the ETag
+            # header isn't readable cross-origin)
+            payload = cached_json({"hash": hashlib.sha256(orjson.dumps(catalog)).hexdigest()[:32], **catalog})
+            if version == self.version:
+                self.catalog = payload
+        return payload
+
+    async def invalidate(self, store: Storage):
+        version = await store.meta.increment("catalog_version", "version")
+        self.subjects.clear()
+        self.catalog = None
+        self.version = version
+        self.checked_at = time.monotonic()
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL)
 
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "مرحباً بك في موقع الأسئلة الوزارية"}
 
-@api_router.get("/grades")
-async def get_grades():
-    return {
-        "grades": [
-            {"id": "sixth_primary", "name": "السادس ابتدائي", "value": GradeType.SIXTH_PRIMARY},
-            {"id": "third_intermediate", "name": "الثالث متوسط", "value": GradeType.THIRD_INTERMEDIATE},
-            {"id": "sixth_preparatory_scientific", "name": "السادس إعدادي - علمي", "value": GradeType.SIXTH_PREPARATORY_SCIENTIFIC},
-            {"id": "sixth_preparatory_literary", "name": "السادس إعدادي - أدبي", "value": GradeType.SIXTH_PREPARATORY_LITERARY}
-        ]
+GRADES_DATA = {
+    "grades": [
+        {"id": "sixth_primary", "name": "السادس ابتدائي", "value": GradeType.SIXTH_PRIMARY},
+        {"id": "third_intermediate", "name": "الثالث متوسط", "value": GradeType.THIRD_INTERMEDIATE},
+        {"id": "sixth_preparatory_scientific", "name": "السادس إعدادي - علمي", "value": GradeType.SIXTH_PREPARATORY_SCIENTIFIC},
+        {"id": "sixth_preparatory_literary", "name": "السادس إعدادي - أدبي", "value": GradeType.SIXTH_PREPARATORY_LITERARY}
+    ]
+}
+GRADES = cached_json(GRADES_DATA)
+
+PRICING_DATA = {
+    "single_subject": {
+        "price": 10,
+        "currency": "USD",
+        "description": "مادة واحدة - كارت رصيد 10$"
+    },
+    "all_subjects": {
+        "price": 50,
+        "currency": "USD", 
+        "description": "جميع المواد - كارت رصيد 50$"
     }
+}
+PRICING = cached_json(PRICING_DATA)
+
+@api_router.get("/grades")
+async def get_grades(request: Request):
+    return cached_json_response(request, GRADES)
 
 @api_router.get("/subjects/{grade}")
-async def get_subjects(grade: GradeType):
-    subjects = await db.subjects.find({"grade": grade}).to_list(1000)
-    return [Subject(**subject) for subject in subjects]
+async def get_subjects(grade: GradeType, request: Request, store: Storage = Depends(get_storage)):
+    return cached_json_response(request, await catalog_cache.get_subjects(store, grade.value))
 
 @api_router.get("/pricing")
-async def get_pricing():
-    return {
-        "single_subject": {
-            "price": 10,
-            "currency": "USD",
-            "description": "مادة واحدة - كارت رصيد 10$"
-        },
-        "all_subjects": {
-            "price": 50,
-            "currency": "USD", 
-            "description": "جميع المواد - كارت رصيد 50$"
-        }
-    }
+async def get_pricing(request: Request):
+    return cached_json_response(request, PRICING)
+
+# Everything the storefront needs (grades with their subjects, pricing) in one response;
+# rebuilt only when subjects change
+@api_router.get("/catalog")
+async def get_catalog(request: Request, store: Storage = Depends(get_storage)):
+    return cached_json_response(request, await catalog_cache.get_catalog(store))
+
+# Scratch cards: every normalized card number is stored in the card index as a keyed hash
+# pointing at its order, so reuse is found with one indexed lookup and card numbers never
+# have to be scanned in plain text. Set CARD_HASH_KEY in production.
+CARD_HASH_KEY = (os.environ.get("CARD_HASH_KEY") or "wazari-card-index").encode()
+ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+
+def normalize_card_number(raw) -> str:
+    return re.sub(r"[^0-9]", "", str(raw).translate(ARABIC_DIGITS))
+
+def parse_card_numbers(card_numbers=None, card_number=None) -> List[str]:
+    # Accepts the modern array or the legacy comma-joined string
+    if card_numbers and isinstance(card_numbers, list):
+        raw = card_numbers
+    elif isinstance(card_number, str):
+        raw = card_number.split(",")
+    else:
+        raw = []
+    cards = [normalize_card_number(card) for card in raw]
+    return [card for card in cards if card]
+
+def mask_card_number(card: str) -> str:
+    return f"•••• {card[-4:]}"
+
+def card_hash(card: str) -> str:
+    return hmac.new(CARD_HASH_KEY, card.encode(), hashlib.sha256).hexdigest()
+
+async def find_card_reuse(store: Storage, cards: List[str]) -> List[str]:
+    return await store.orders.find_card_orders([card_hash(card) for card in cards])
+
+async def index_order_cards(store: Storage, order_id: str, cards: List[str], created_at: datetime):
+    hashes = list(dict.fromkeys(card_hash(card) for card in cards))
+    await store.orders.add_card_uses(order_id, hashes, created_at)
+
+def set_card_check_fields(order: dict, duplicate_of: List[str]):
+    order["card_numbers_masked"] = [mask_card_number(card) for card in order["card_numbers"]]
+    order["suspected_duplicate"] = bool(duplicate_of)
+    order["duplicate_of"] = duplicate_of
+
+async def apply_card_checks(store: Storage, order: dict):
+    set_card_check_fields(order, await find_card_reuse(store, order["card_numbers"]))
+
+# Bump CARD_INDEX_VERSION when hashing or masking changes so every order is re-indexed
+# on the next startup
+CARD_INDEX_VERSION = 1
+CARD_BACKFILL_BATCH = 500
+
+async def write_card_backfill(store: Storage, uses: list, masked: Dict[str, dict]):
+    await asyncio.gather(store.orders.add_card_uses_many(uses), store.orders.update_each(masked))
+
+async def backfill_card_index(store: Storage) -> int:
+    indexed = 0
+    fields = {"_id": 0, "id": 1, "card_numbers": 1, "created_at": 1}
+    uses, masked = [], {}
+    async for order in store.orders.iterate(OrderFilter(), fields, include_archived=True):
+        cards = parse_card_numbers(order.get("card_numbers"))
+        hashes = list(dict.fromkeys(card_hash(card) for card in cards))
+        uses.append((order["id"], hashes, order.get("created_at") or datetime.utcnow()))
+        masked[order["id"]] = {"card_numbers_masked": [mask_card_number(card) for card in cards]}
+        if len(masked) >= CARD_BACKFILL_BATCH:
+            await write_card_backfill(store, uses, masked)
+            indexed += len(masked)
+            uses, masked = [], {}
+    await write_card_backfill(store, uses, masked)
+    return indexed + len(masked)
+
+async def ensure_card_index(store: Storage):
+    # Runs in the background at startup; every worker may run it, the writes are idempotent
+    index = await store.meta.get("card_index")
+    if index and index.get("version") == CARD_INDEX_VERSION:
+        return
+    try:
+        indexed = await backfill_card_index(store)
+    except Exception:
+        logger.exception("Card index backfill failed")
+        return
+    await store.meta.set("card_index", {"version": CARD_INDEX_VERSION, "indexed_at": datetime.utcnow()})
+    logger.info("Indexed cards of %d orders (version %s)", indexed, CARD_INDEX_VERSION)
+
+# Admin search: each order stores normalized tokens of its contact fields and id in
+# search_keys (indexed), and a query matches orders having, for every query term, a key
+# starting with it. Bump SEARCH_KEYS_VERSION when the normalization changes so existing
+# orders are re-keyed on the next startup; the version last completed is kept in meta.
+SEARCH_FIELDS = ("student_name", "telegram_username", "phone_number", "email", "contact_value")
+SEARCH_KEYS_VERSION = 1
+SEARCH_BACKFILL_BATCH = 500
+SEARCH_TERMS_MAX = 5
+SEARCH_LIMIT_DEFAULT = 20
+PHONE_SUFFIX_MIN = 7
+PHONE_SUFFIX_MAX = 10
+# Harakat, Quranic annotation marks and tatweel
+ARABIC_DIACRITICS_RE = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+# Alef variants -> ا, alef maqsura / Persian yeh -> ي, taa marbuta -> ه, plus digits
+SEARCH_FOLDING = {**ARABIC_DIGITS, **str.maketrans("أإآٱىیة", "ااااييه")}
+SEARCH_SEPARATORS_RE = re.compile(r"[\s,;:()]+")
+
+def normalize_search_text(value) -> str:
+    # NFKC maps presentation forms to base letters and composes hamza-on-alef first
+    text = unicodedata.normalize("NFKC", str(value)).casefold()
+    return ARABIC_DIACRITICS_RE.sub("", text).translate(SEARCH_FOLDING)
+
+def search_tokens(value) -> List[str]:
+    tokens = (token.lstrip("@+") for token in SEARCH_SEPARATORS_RE.split(normalize_search_text(value)))
+    return [token for token in tokens if token]
+
+def order_search_keys(order: dict) -> List[str]:
+    keys = {str(order["id"]).lower()}
+    for field in SEARCH_FIELDS:
+        value = order.get(field)
+        if not value:
+            continue
+        tokens = search_tokens(value)
+        keys.update(tokens)
+        digits = re.sub(r"[^0-9]", "", "".join(tokens))
+        if len(digits) >= 4:
+            keys.update(phone_search_keys(digits))
+    return sorted(keys)
+
+def phone_search_keys(digits: str) -> List[str]:
+    # Phone numbers match however they were spaced or punctuated, and with or without the
+    # country code / trunk 0 (+964 770 123 4567 is found as 0770123..., 770123...)
+    keys = [digits]
+    for length in range(PHONE_SUFFIX_MIN, min(len(digits), PHONE_SUFFIX_MAX + 1)):
+        suffix = digits[-length:]
+        keys.extend([suffix, "0" + suffix] if not suffix.startswith("0") else [suffix])
+    return keys
+
+def with_search_keys(order: dict) -> dict:
+    return {**order, "search_keys": order_search_keys(order), "search_version": SEARCH_KEYS_VERSION}
+
+async def backfill_search_keys(store: Storage) -> int:
+    fields = {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELDS}}
+    stale = OrderFilter(search_version_not=SEARCH_KEYS_VERSION)
+    indexed = 0
+    batch = {}
+    async for order in store.orders.iterate(stale, fields, include_archived=True):
+        batch[order["id"]] = {"search_keys": order_search_keys(order), "search_version": SEARCH_KEYS_VERSION}
+        if len(batch) >= SEARCH_BACKFILL_BATCH:
+            await store.orders.update_each(batch)
+            indexed += len(batch)
+            batch = {}
+    await store.orders.update_each(batch)
+    return indexed + len(batch)
+
+async def ensure_search_keys(store: Storage):
+    # Runs in the background at startup; every worker may run it, the updates are idempotent
+    keys = await store.meta.get("search_keys")
+    if keys and keys.get("version") == SEARCH_KEYS_VERSION:
+        return
+    try:
+        indexed = await backfill_search_keys(store)
+    except Exception:
+        logger.exception("Search key backfill failed")
+        return
+    await store.meta.set("search_keys", {"version": SEARCH_KEYS_VERSION, "indexed_at": datetime.utcnow()})
+    logger.info("Backfilled search keys for %d orders (version %s)", indexed, SEARCH_KEYS_VERSION)
+
+# Idempotent order creation: the first request with a given Idempotency-Key claims it for
+# its order id; retries with the same key get the stored order back instead of a duplicate.
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+async def claim_idempotency_key(store: Storage, key: Optional[str], order_id: str) -> Optional[dict]:
+    if not key:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    claimed_order_id = await store.orders.claim_idempotency_key(key, order_id)
+    if claimed_order_id is None:
+        return None
+    order = await store.orders.get(claimed_order_id, ORDER_PROJECTION) if claimed_order_id else None
+    if not order:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+    return order
+
+async def release_idempotency_key(store: Storage, key: Optional[str]):
+    if key:
+        await store.orders.release_idempotency_key(key)
 
 @api_router.post("/orders/simple")
-async def create_order_simple(data: dict):
+async def create_order_simple(
+    data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    store: Storage = Depends(get_storage),
+):
     try:
         student_name = (data.get("student_name") or "").strip()
         telegram_username = (data.get("telegram_username") or "").strip()
@@ -183,11 +1376,7 @@ async def create_order_simple(data: dict):
         grade = data.get("grade")
         purchase_type = data.get("purchase_type", "single")
         selected_subjects = data.get("selected_subjects") or []
-        cards = []
-        if isinstance(data.get("card_numbers"), list):
-            cards = [str(c).replace(" ", "").strip() for c in data["card_numbers"] if str(c).strip()]
-        elif isinstance(data.get("card_number"), str):
-            cards = [x.strip() for x in data["card_number"].split(",") if x.strip()]
+        cards = parse_card_numbers(data.get("card_numbers"), data.get("card_number"))
         total_amount = 50 if purchase_type == "all" else max(len(selected_subjects), 1) * 10
 
         order = {
@@ -209,34 +1398,30 @@ async def create_order_simple(data: dict):
             "confirmed_at": None,
         }
 
-        await db.orders.insert_one(order)
+        existing = await claim_idempotency_key(store, idempotency_key, order["id"])
+        if existing:
+            return ORJSONResponse({"ok": True, "order": existing})
 
-        tg_token = os.environ.get("TELEGRAM_BOT_TOKEN") or "6184834915:AAHB4TZr_O5_djf1HcZl7cZPtDEsGUKAdXQ"
-        tg_chat = os.environ.get("TELEGRAM_CHAT_ID") or "981403292"
-        if tg_token and tg_chat:
-            try:
-                cards_text = "\n".join([f"• {c}" for c in (order.get("card_numbers") or [])]) or "—"
-                kind_text = "جميع المواد" if order.get('purchase_type') == 'all' else f"مواد منفردة ({len(order.get('selected_subjects') or [])})"
-                text = (
-                    "طلب جديد ✅\n"
-                    f"الطالب: {order.get('student_name','')}\n"
-                    f"الصف: {order.get('grade','')}\n"
-                    f"النوع: {kind_text}\n"
-                    f"المبلغ: ${order.get('total_amount','')}\n"
-                    f"التواصل: {order.get('contact_method','') or ''} {order.get('contact_value','') or ''}\n"
-                    f"الكروت:\n{cards_text}\n"
-                    f"رقم الطلب: {order.get('id','')}"
-                )
-                await send_telegram_message(tg_token, tg_chat, text)
-            except Exception:
-                pass
+        try:
+            await apply_card_checks(store, order)
+            await store.orders.insert(with_search_keys(order))
+        except Exception:
+            await release_idempotency_key(store, idempotency_key)
+            raise
+        await asyncio.gather(
+            index_order_cards(store, order["id"], cards, order["created_at"]),
+            enqueue_telegram_message(store, format_order_message(order)),
+            record_order_stats(store, [(order, 1)]),
+        )
+        order_events.publish_local("order_created", listed_order(order))
 
-        return {"ok": True, "order": order}
+        return ORJSONResponse({"ok": True, "order": order})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/orders")
-async def create_order(order_data: OrderCreateFlex):
+def build_order(order_data: OrderCreateFlex) -> Order:
     # Calculate total amount
     # Coerce enums from strings
     pt = str(order_data.purchase_type)
@@ -250,15 +1435,10 @@ async def create_order(order_data: OrderCreateFlex):
     # Calculate total amount
     total_amount = (len(selected_subjects) * 10) if purchase == PurchaseType.SINGLE_SUBJECT else 50
 
-    # Normalize and validate card numbers from array or single joined string
-    cards = []
-    if order_data.card_numbers:
-        cards = [cn.replace(" ", "") for cn in order_data.card_numbers if cn and cn.strip()]
-    elif order_data.card_number:
-        cards = [c.strip() for c in order_data.card_number.split(",") if c.strip()]
+    # Normalize card numbers from array or single joined string
+    cards = parse_card_numbers(order_data.card_numbers, order_data.card_number)
 
-    # Create order
-    order = Order(
+    return Order(
         student_name=order_data.student_name,
         telegram_username=order_data.telegram_username or "",
         phone_number=order_data.phone_number or "",
@@ -273,97 +1453,634 @@ async def create_order(order_data: OrderCreateFlex):
         total_amount=total_amount
     )
 
-    # Save order
-    await db.orders.insert_one(order.dict())
+@api_router.post("/orders")
+async def create_order(
+    order_data: OrderCreateFlex,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    store: Storage = Depends(get_storage),
+):
+    order = build_order(order_data)
+
+    existing = await claim_idempotency_key(store, idempotency_key, order.id)
+    if existing:
+        # Stored orders were validated on the way in
+        return ORJSONResponse(existing)
+
+    # Save order and queue the Telegram notification
+    order_doc = order.dict()
+    try:
+        await apply_card_checks(store, order_doc)
+        await store.orders.insert(with_search_keys(order_doc))
+    except Exception:
+        await release_idempotency_key(store, idempotency_key)
+        raise
+    await asyncio.gather(
+        index_order_cards(store, order.id, order.card_numbers, order.created_at),
+        enqueue_telegram_message(store, format_order_message(order_doc)),
+        record_order_stats(store, [(order_doc, 1)]),
+    )
+    order_events.publish_local("order_created", listed_order(order_doc))
+
+    # Already plain JSON-able data; skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse(order_doc)
 
-    # Telegram notify (best-effort)
-    tg_token = os.environ.get("TELEGRAM_BOT_TOKEN") or "6184834915:AAHB4TZr_O5_djf1HcZl7cZPtDEsGUKAdXQ"
-    tg_chat = os.environ.get("TELEGRAM_CHAT_ID") or "981403292"
-    if tg_token and tg_chat:
+def listed_order(order: dict) -> dict:
+    return {field: order.get(field) for field in ORDER_LIST_PROJECTION if field != "_id"}
+
+# Batched ingestion for resellers re-entering orders collected offline: every item goes
+# through the same normalization as POST /orders, card reuse is checked with one index
+# lookup (including reuse within the batch), the orders are written with one unordered
+# insert and announced in a single Telegram summary.
+ORDERS_BATCH_MAX = 100
+TELEGRAM_TEXT_MAX = 4096
+
+class OrderBatchRequest(BaseModel):
+    # Items are validated one by one so a bad row doesn't reject the whole batch
+    orders: List[dict] = Field(..., min_length=1, max_length=ORDERS_BATCH_MAX)
+    source: Optional[str] = Field(None, max_length=100)
+
+def validation_error_text(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        first = error.errors()[0]
+        return f"{'.'.join(str(part) for part in first['loc'])}: {first['msg']}"
+    return str(error)
+
+def format_batch_message(orders: List[dict], source: Optional[str]) -> str:
+    header = [
+        f"طلبات جديدة ✅ ({len(orders)})",
+        *([f"المصدر: {source}"] if source else []),
+        f"المجموع: ${sum(order.get('total_amount') or 0 for order in orders)}",
+    ]
+    lines = [
+        f"• {order.get('student_name', '')} | {stat_value(order.get('grade', ''))} | ${order.get('total_amount', '')}"
+        f"{' ⚠️' if order.get('suspected_duplicate') else ''} | {order.get('id', '')[:8]}"
+        for order in orders
+    ]
+    text = "\n".join(header + lines)
+    # One message: drop lines from the end until it fits Telegram's limit
+    while len(text) > TELEGRAM_TEXT_MAX and lines:
+        lines.pop()
+        text = "\n".join(header + lines + [f"… و{len(orders) - len(lines)} طلبات أخرى"])
+    return text
+
+@api_router.post("/orders/batch")
+async def create_orders_batch(request: OrderBatchRequest, store: Storage = Depends(get_storage)):
+    results: List[Optional[dict]] = [None] * len(request.orders)
+    orders = []  # (index in request, order document)
+    for index, item in enumerate(request.orders):
         try:
-            cards_text = "\n".join([f"• {c}" for c in (order.card_numbers or [])]) or "—"
-            subjects_count = len(order.selected_subjects or [])
-            kind_text = "جميع المواد" if purchase == PurchaseType.ALL_SUBJECTS else f"مواد منفردة ({subjects_count})"
-            text = (
-                "طلب جديد ✅\n"
-                f"الطالب: {order.student_name}\n"
-                f"الصف: {order.grade}\n"
-                f"النوع: {kind_text}\n"
-                f"المبلغ: ${total_amount}\n"
-                f"التواصل: {order.contact_method or ''} {order.contact_value or ''}\n"
-                f"الكروت:\n{cards_text}\n"
-                f"رقم الطلب: {order.id}"
-            )
-            await send_telegram_message(tg_token, tg_chat, text)
-        except Exception:
-            pass
+            orders.append((index, build_order(OrderCreateFlex.model_validate(item)).dict()))
+        except (ValidationError, ValueError) as e:
+            results[index] = {"index": index, "result": "invalid", "error": validation_error_text(e)}
+
+    # Card reuse against stored orders and earlier items of this batch
+    card_hashes = {index: list(dict.fromkeys(card_hash(card) for card in order["card_numbers"])) for index, order in orders}
+    stored_uses = await store.orders.find_card_uses(list({h for hashes in card_hashes.values() for h in hashes}))
+    batch_uses = defaultdict(list)
+    for index, order in orders:
+        duplicate_of = []
+        for h in card_hashes[index]:
+            duplicate_of.extend(stored_uses.get(h, ()))
+            duplicate_of.extend(batch_uses[h])
+            batch_uses[h].append(order["id"])
+        set_card_check_fields(order, list(dict.fromkeys(duplicate_of)))
+
+    failed = set(await store.orders.insert_many([with_search_keys(order) for _, order in orders]))
+    created = []
+    for position, (index, order) in enumerate(orders):
+        if position in failed:
+            results[index] = {"index": index, "result": "failed"}
+        else:
+            created.append((index, order))
+            results[index] = {
+                "index": index,
+                "result": "created",
+                "id": order["id"],
+                "total_amount": order["total_amount"],
+                "suspected_duplicate": order["suspected_duplicate"],
+            }
+
+    if created:
+        await store.orders.add_card_uses_many(
+            [(order["id"], card_hashes[index], order["created_at"]) for index, order in created]
+        )
+        await enqueue_telegram_message(store, format_batch_message([order for _, order in created], request.source))
+        await record_order_stats(store, [(order, 1) for _, order in created])
+        for _, order in created:
+            order_events.publish_local("order_created", listed_order(order))
+
+    counts = defaultdict(int)
+    for result in results:
+        counts[result["result"]] += 1
+    return ORJSONResponse({
+        "results": results,
+        "created": counts["created"],
+        "invalid": counts["invalid"],
+        "failed": counts["failed"],
+    })
 
-    return order.dict()  # response as JSON
+# Order listing: keyset pagination on (created_at, id), newest first
+ORDERS_PAGE_DEFAULT = 50
+ORDERS_PAGE_MAX = 200
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Orders store naive UTC; "2024-05-01T00:00:00+03:00" must compare as 2024-04-30T21:00
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def encode_order_cursor(order: dict) -> str:
+    raw = json.dumps({"c": order["created_at"].isoformat(), "i": order["id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_order_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["c"]), str(data["i"])
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @api_router.get("/orders")
-async def get_orders(order_status: Optional[str] = None):
-    query = {}
-    if order_status:
-        query["status"] = order_status
-    
-    orders = await db.orders.find(query).sort("created_at", -1).to_list(1000)
-    return [Order(**order) for order in orders]
+async def get_orders(
+    order_status: Optional[str] = None,
+    grade: Optional[str] = None,
+    purchase_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(ORDERS_PAGE_DEFAULT, ge=1, le=ORDERS_PAGE_MAX),
+    include_archived: bool = False,
+    store: Storage = Depends(get_storage),
+):
+    filters = OrderFilter(order_status, grade, purchase_type, naive_utc(created_from), naive_utc(created_to))
+    after = decode_order_cursor(cursor) if cursor else None
+
+    # Fetch one extra row to know whether another page exists
+    orders = await store.orders.list(filters, after, limit + 1, ORDER_LIST_PROJECTION, include_archived)
+    next_cursor = encode_order_cursor(orders[limit - 1]) if len(orders) > limit else None
+    return ORJSONResponse({"orders": orders[:limit], "next_cursor": next_cursor})
+
+@api_router.get("/orders/search")
+async def search_orders(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=ORDERS_PAGE_MAX),
+    include_archived: bool = False,
+    store: Storage = Depends(get_storage),
+):
+    terms = list(dict.fromkeys(search_tokens(q)))[:SEARCH_TERMS_MAX]
+    if not terms:
+        return ORJSONResponse({"orders": []})
+    orders = await store.orders.search(terms, limit, ORDER_LIST_PROJECTION, include_archived)
+    return ORJSONResponse({"orders": orders})
+
+# Streaming export: rows go straight from the storage cursor to the client in small chunks
+EXPORT_COLUMNS = [
+    "id", "created_at", "status", "student_name", "telegram_username", "phone_number", "email",
+    "contact_method", "contact_value", "client_key", "grade", "purchase_type", "selected_subjects",
+    "card_numbers", "total_amount", "confirmed_at",
+]
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_PROJECTION = {"_id": 0, "search_keys": 0, "search_version": 0}
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Spreadsheet apps run cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def export_csv_value(value):
+    if isinstance(value, list):
+        value = " ".join(str(v) for v in value)
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        # Public input (names, contact values): neutralize as text
+        return "'" + value
+    return "" if value is None else value
+
+async def export_order_rows(store: Storage, filters: OrderFilter, export_format: str, include_archived: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        # BOM so spreadsheet apps detect UTF-8 (Arabic names)
+        buffer.write("\ufeff")
+        writer.writerow(EXPORT_COLUMNS)
+
+    async for order in store.orders.iterate(filters, EXPORT_PROJECTION, include_archived):
+        if export_format == "csv":
+            writer.writerow([export_csv_value(order.get(column)) for column in EXPORT_COLUMNS])
+        else:
+            buffer.write(json.dumps(order, ensure_ascii=False, default=export_json_default))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+@api_router.get("/orders/export")
+async def export_orders(
+    export_format: str = Query("ndjson", alias="format", pattern="^(csv|ndjson)$"),
+    order_status: Optional[str] = None,
+    grade: Optional[str] = None,
+    purchase_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    include_archived: bool = False,
+    store: Storage = Depends(get_storage),
+):
+    filters = OrderFilter(order_status, grade, purchase_type, naive_utc(created_from), naive_utc(created_to))
+    media_type = "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+    filename = f"orders-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}"
+    return StreamingResponse(
+        export_order_rows(store, filters, export_format, include_archived),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+async def order_event_stream(request: Request):
+    queue = order_events.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+    finally:
+        order_events.unsubscribe(queue)
+
+@api_router.get("/orders/stream")
+async def stream_orders(request: Request):
+    return StreamingResponse(
+        order_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Customer-facing "my orders": no card numbers or admin-only fields
+ORDER_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in OrderSummary.model_fields}}
+CLIENT_ORDERS_MAX = 100
+
+# The projection limits the output to OrderSummary fields; response_model would be bypassed
+# by ORJSONResponse anyway
+@api_router.get("/orders/by-client/{client_key}")
+async def get_orders_by_client(client_key: str, store: Storage = Depends(get_storage)):
+    orders = await store.orders.list_by_client(
+        client_key, CLIENT_ORDERS_MAX, ORDER_SUMMARY_PROJECTION, include_archived=True
+    )
+    return ORJSONResponse(orders)
 
 @api_router.put("/orders/{order_id}")
-async def update_order(order_id: str, update_data: OrderUpdate):
+async def update_order(order_id: str, update_data: OrderUpdate, store: Storage = Depends(get_storage)):
     update_dict = update_data.dict(exclude_unset=True)
 
     if update_data.status == OrderStatus.CONFIRMED:
         update_dict["confirmed_at"] = datetime.utcnow()
 
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": update_dict}
-    )
+    # One round trip: the pre-image (needed for the stats delta) plus our own $set is the
+    # updated document, so it isn't read back
+    previous = await store.orders.update(order_id, update_dict, ORDER_PROJECTION)
 
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    updated_order = {**previous, **{k: v for k, v in update_dict.items() if k in ORDER_PROJECTION}}
+    await record_order_stats(store, [(previous, -1), (updated_order, 1)])
+    order_events.publish_local("order_updated", {"id": order_id, **update_dict})
+    if update_data.status == OrderStatus.CONFIRMED and previous.get("status") != OrderStatus.CONFIRMED.value:
+        await enqueue_fulfillment(store, order_id, fulfillment_chat_id(previous))
 
-    updated_order = await db.orders.find_one({"id": order_id})
-    return Order(**updated_order)
+    return ORJSONResponse(updated_order)
 
 @api_router.get("/orders/{order_id}")
-async def get_order(order_id: str):
-    order = await db.orders.find_one({"id": order_id})
+async def get_order(order_id: str, store: Storage = Depends(get_storage)):
+    order = await store.orders.get(order_id, ORDER_PROJECTION, include_archived=True)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return Order(**order)
+    return ORJSONResponse(order)
 
 @api_router.delete("/orders/{order_id}")
-async def delete_order(order_id: str):
-    result = await db.orders.delete_one({"id": order_id})
-    if result.deleted_count == 0:
+async def delete_order(order_id: str, store: Storage = Depends(get_storage)):
+    deleted = await store.orders.delete(order_id, STATS_FIELDS)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    await asyncio.gather(record_order_stats(store, [(deleted, -1)]), store.orders.remove_card_uses([order_id]))
+    order_events.publish_local("order_deleted", {"id": order_id})
     return {"message": "Order deleted successfully"}
 
+@api_router.post("/orders/bulk")
+async def bulk_update_orders(request: OrderBulkRequest, store: Storage = Depends(get_storage)):
+    if request.delete == (request.status is not None):
+        raise HTTPException(status_code=400, detail="Provide either a status or delete=true")
+
+    order_ids = list(dict.fromkeys(request.order_ids))
+    found = {
+        order["id"]: order
+        for order in await store.orders.get_many(
+            order_ids, {**STATS_FIELDS, "id": 1, "contact_method": 1, "contact_value": 1}, include_archived=True
+        )
+    }
+
+    if request.delete:
+        outcome = "deleted"
+    else:
+        update_dict = {"status": request.status}
+        if request.admin_notes is not None:
+            update_dict["admin_notes"] = request.admin_notes
+        if request.status == OrderStatus.CONFIRMED:
+            update_dict["confirmed_at"] = datetime.utcnow()
+        outcome = "updated"
+
+    if found:
+        if request.delete:
+            await store.orders.delete_many(list(found))
+            await record_order_stats(store, [(order, -1) for order in found.values()])
+            await store.orders.remove_card_uses(list(found))
+        else:
+            await store.orders.update_many(list(found), update_dict)
+            await record_order_stats(
+                store,
+                [(order, -1) for order in found.values()] +
+                [({**order, **update_dict}, 1) for order in found.values()]
+            )
+        newly_confirmed = []
+        for order_id in order_ids:
+            if order_id not in found:
+                continue
+            if request.delete:
+                order_events.publish_local("order_deleted", {"id": order_id})
+            else:
+                order_events.publish_local("order_updated", {"id": order_id, **update_dict})
+                if request.status == OrderStatus.CONFIRMED and found[order_id].get("status") != OrderStatus.CONFIRMED.value:
+                    newly_confirmed.append((order_id, fulfillment_chat_id(found[order_id])))
+        await enqueue_fulfillments(store, newly_confirmed)
+
+    results = [
+        {"id": order_id, "result": outcome if order_id in found else "not_found"}
+        for order_id in order_ids
+    ]
+    return {
+        "results": results,
+        "matched": len(found),
+        "not_found": len(order_ids) - len(found),
+    }
+
+# Fulfillment progress (for admin)
+@api_router.get("/orders/{order_id}/fulfillment")
+async def get_order_fulfillment(order_id: str, store: Storage = Depends(get_storage)):
+    job = await store.fulfillments.get(order_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No fulfillment for this order")
+    batches = job.pop("batches") or []
+    return ORJSONResponse({**job, "total_batches": len(batches)})
+
+@api_router.post("/orders/{order_id}/fulfillment/retry")
+async def retry_order_fulfillment(order_id: str, store: Storage = Depends(get_storage)):
+    job = await store.fulfillments.get(order_id)
+    if not job or job["status"] != FulfillmentStatus.FAILED.value:
+        raise HTTPException(status_code=409, detail="Only failed fulfillments can be retried")
+    # Resumes after the last batch that was sent
+    await store.fulfillments.update(order_id, {
+        "status": FulfillmentStatus.PENDING.value,
+        "attempts": 0,
+        "next_attempt_at": datetime.utcnow(),
+        "completed_at": None,
+    })
+    fulfillment_worker.wake()
+    return {"message": "Fulfillment rescheduled"}
+
+# Card reuse lookup (for admin)
+@api_router.get("/cards/{card_number}/orders")
+async def get_card_orders(card_number: str, store: Storage = Depends(get_storage)):
+    card = normalize_card_number(card_number)
+    if not card:
+        raise HTTPException(status_code=400, detail="Invalid card number")
+    order_ids = await store.orders.find_card_orders([card_hash(card)])
+    orders = await store.orders.get_many(order_ids, ORDER_LIST_PROJECTION, include_archived=True)
+    return ORJSONResponse({"card": mask_card_number(card), "orders": orders})
+
+# Sales statistics (for admin)
+@api_router.get("/stats")
+async def get_stats(days: int = Query(STATS_DAYS_DEFAULT, ge=1, le=366), store: Storage = Depends(get_storage)):
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    counters = await store.orders.read_stats(since)
+
+    stats = {"total": {"count": 0, "revenue": 0}, **{f"by_{dimension}": {} for dimension in STATS_DIMENSIONS}}
+    for counter in counters:
+        value = {"count": counter["count"], "revenue": counter["revenue"]}
+        if counter["dimension"] == "total":
+            stats["total"] = value
+        elif counter["count"]:
+            stats[f"by_{counter['dimension']}"][counter["key"]] = value
+    return stats
+
+@api_router.post("/stats/rebuild")
+async def rebuild_stats(store: Storage = Depends(get_storage)):
+    return {"counters": await rebuild_order_stats(store)}
+
 # Subject management (for admin)
 @api_router.post("/subjects", response_model=Subject)
-async def create_subject(subject_data: SubjectCreate):
+async def create_subject(subject_data: SubjectCreate, store: Storage = Depends(get_storage)):
     subject = Subject(**subject_data.dict())
-    await db.subjects.insert_one(subject.dict())
+    try:
+        await store.subjects.insert(subject.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A subject with this name already exists in this grade")
+    await catalog_cache.invalidate(store)
     return subject
 
 @api_router.put("/subjects/{subject_id}")
-async def update_subject(subject_id: str, subject_data: SubjectCreate):
-    result = await db.subjects.update_one(
-        {"id": subject_id},
-        {"$set": subject_data.dict()}
-    )
-    
-    if result.matched_count == 0:
+async def update_subject(subject_id: str, subject_data: SubjectCreate, store: Storage = Depends(get_storage)):
+    # An edited subject belongs to the admin: reseeding must no longer remove it
+    changes = {**subject_data.dict(), "seeded": False}
+    try:
+        updated_subject = await store.subjects.update(subject_id, changes, SUBJECT_PROJECTION)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A subject with this name already exists in this grade")
+
+    if updated_subject is None:
         raise HTTPException(status_code=404, detail="Subject not found")
-    
-    updated_subject = await db.subjects.find_one({"id": subject_id})
-    return Subject(**updated_subject)
+    await catalog_cache.invalidate(store)
+
+    return ORJSONResponse(updated_subject)
+
+# Subject images: uploads go to the content-addressed asset store (assets.py) and their
+# /api/assets/... URLs are appended to the subject. Assets never change, so they are served
+# with immutable cache headers and byte-range support.
+ASSETS_DIR = Path(os.environ.get("ASSETS_DIR") or ROOT_DIR / "assets")
+ASSET_WORKERS = int(os.environ.get("ASSET_WORKERS", "2"))
+ASSET_MAX_BYTES = int(os.environ.get("ASSET_MAX_BYTES", str(10 * 1024 * 1024)))
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+asset_store = AssetStore(ASSETS_DIR, ASSET_WORKERS)
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Single ranges only; anything else gets the full file, which RFC 9110 allows
+    match = RANGE_RE.match(header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def file_chunks(path: Path, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(ASSET_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def asset_response(request: Request, path: Path, media_type: str, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": ASSET_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    size = path.stat().st_size
+    if_range = request.headers.get("if-range")
+    requested = byte_range(request.headers.get("range"), size) if if_range in (None, etag) else None
+    if requested is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = requested
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return StreamingResponse(file_chunks(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
+
+@api_router.post("/subjects/{subject_id}/images")
+async def upload_subject_images(subject_id: str, files: List[UploadFile] = File(...), store: Storage = Depends(get_storage)):
+    urls = []
+    for upload in files:
+        data = await upload.read(ASSET_MAX_BYTES + 1)
+        if len(data) > ASSET_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"{upload.filename}: image is too large")
+        try:
+            urls.append((await asset_store.ingest(data)).url)
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=f"{upload.filename}: {e}")
+
+    # Identical uploads map to the same URL and are only listed once
+    updated_subject = await store.subjects.add_image_urls(subject_id, list(dict.fromkeys(urls)), SUBJECT_PROJECTION)
+    if updated_subject is None:
+        raise HTTPException(status_code=404, detail="Subject not found")
+    await catalog_cache.invalidate(store)
+    return ORJSONResponse(updated_subject)
+
+@api_router.get("/assets/{digest}/{variant}.jpg")
+async def get_asset_variant(digest: str, variant: str, request: Request):
+    path = await asset_store.variant(digest, variant) if DIGEST_RE.match(digest) and variant in ASSET_VARIANTS else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return asset_response(request, path, "image/jpeg", f'"{digest[:32]}-{variant}"')
+
+@api_router.get("/assets/{digest}.{ext}")
+async def get_asset(digest: str, ext: str, request: Request):
+    path = asset_store.original_path(digest, ext) if parse_asset_url(f"/api/assets/{digest}.{ext}") else None
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return asset_response(request, path, ASSET_MEDIA_TYPES[ext], f'"{digest[:32]}"')
+
+# Diagnostics: query shapes issued by each route, checked against explain()
+QUERY_SHAPES = [
+    ("GET /api/orders", "orders", {}, ORDERS_SORT),
+    ("GET /api/orders?order_status=", "orders", {"status": "pending"}, ORDERS_SORT),
+    ("GET /api/orders/search", "orders", {"search_keys": {"$regex": "^a"}}, ORDERS_SORT),
+    ("GET /api/orders/by-client/{client_key}", "orders", {"client_key": ""}, [("created_at", -1)]),
+    ("GET /api/orders/{order_id}", "orders", {"id": ""}, None),
+    ("PUT /api/orders/{order_id}", "orders", {"id": ""}, None),
+    ("DELETE /api/orders/{order_id}", "orders", {"id": ""}, None),
+    ("GET /api/subjects/{grade}", "subjects", {"grade": GradeType.SIXTH_PRIMARY.value}, None),
+    ("PUT /api/subjects/{subject_id}", "subjects", {"id": ""}, None),
+]
+
+def plan_stages(plan: dict) -> List[str]:
+    # Mongo 7+ (SBE) nests the classic plan under "queryPlan"
+    plan = plan.get("queryPlan", plan)
+    stages = [plan.get("stage", "")]
+    children = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+    for child in children:
+        stages.extend(plan_stages(child))
+    return stages
+
+async def explain_query_shapes(db) -> List[dict]:
+    results = []
+    for route, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({
+            "route": route,
+            "collection": collection,
+            "filter": query,
+            "sort": sort,
+            "stages": stages,
+            "index_scan": "IXSCAN" in stages or "IDHACK" in stages,
+        })
+    return results
+
+@api_router.get("/diagnostics/indexes")
+async def get_index_diagnostics(store: Storage = Depends(get_storage)):
+    if not isinstance(store, MotorStorage):
+        raise HTTPException(status_code=501, detail="Index diagnostics require the mongo storage backend")
+    return {
+        "indexes": {
+            "orders": await store.db.orders.index_information(),
+            "orders_archive": await store.db.orders_archive.index_information(),
+            "subjects": await store.db.subjects.index_information(),
+        },
+        "query_plans": await explain_query_shapes(store.db),
+    }
+
+@api_router.get("/diagnostics/admission")
+async def get_admission_diagnostics():
+    return admission.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost first: HTTP metrics see routed requests; requests shed by admission control
+# are counted in admission_requests_total
+if METRICS_ENABLED:
+    app.add_middleware(
+        HTTPMetricsMiddleware,
+        duration=metrics_registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency until the response completes.",
+            ("method", "route", "status"),
+        ),
+        in_flight=metrics_registry.gauge("http_requests_in_flight", "HTTP requests currently being served.", ("method",)),
+    )
+app.add_middleware(AdmissionControlMiddleware, controller=admission, store=app_storage)
+# Outside the metrics middleware, so recorded latencies exclude compression time
+if COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_level=COMPRESSION_GZIP_LEVEL,
+        brotli_quality=COMPRESSION_BROTLI_QUALITY,
+        metrics=compression_metrics,
+    )
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -381,9 +2098,43 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_default_subjects()
+    store = app_storage()
+    await store.ensure_indexes()
+    await init_default_subjects(store)
+    await telegram_outbox.start(store)
+    if FULFILLMENT_ENABLED:
+        await fulfillment_worker.start(store)
+    if ARCHIVE_ENABLED:
+        await order_archiver.start(store)
+    app.state.search_backfill_task = asyncio.create_task(ensure_search_keys(store))
+    app.state.card_backfill_task = asyncio.create_task(ensure_card_index(store))
+    if ORDER_EVENTS_SOURCE == "changestream":
+        if not isinstance(store, MotorStorage):
+            raise RuntimeError("ORDER_EVENTS_SOURCE=changestream requires STORAGE_BACKEND=mongo")
+        app.state.order_watch_task = asyncio.create_task(order_events.watch_changes(store))
     logger.info("Application started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await telegram_outbox.stop()
+    await fulfillment_worker.stop()
+    await order_archiver.stop()
+    for name in ("order_watch_task", "search_backfill_task", "card_backfill_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    app_storage().close()
+
+# Maintenance commands: python server.py rebuild-stats | index-cards | archive-orders | index-search
+if __name__ == "__main__":
+    import sys
+
+    commands = {
+        "rebuild-stats": rebuild_order_stats,
+        "index-cards": backfill_card_index,
+        "archive-orders": archive_settled_orders,
+        "index-search": backfill_search_keys,
+    }
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit(f"usage: python server.py [{'|'.join(commands)}]")
+    print(asyncio.run(commands[sys.argv[1]](storage)))
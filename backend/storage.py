@@ -0,0 +1,1117 @@
+import asyncio
+import copy
+import heapq
+import logging
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import (
+    ASCENDING, DESCENDING, IndexModel, UpdateOne, DeleteOne, DeleteMany, ReplaceOne, ReturnDocument, WriteConcern,
+)
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+
+# Storage layer: server.py reaches orders, subjects and their bookkeeping collections only
+# through these repositories. MotorStorage is the MongoDB backend; MemoryStorage keeps
+# everything in process so handlers can be tested and profiled without a database.
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+ORDERS_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+class OrderFilter(NamedTuple):
+    status: Optional[str] = None
+    grade: Optional[str] = None
+    purchase_type: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    # Orders whose search keys were built by another version (or never built)
+    search_version_not: Optional[int] = None
+
+# (dimension, key) -> (count delta, revenue delta)
+StatDeltas = Dict[Tuple[str, str], Tuple[int, int]]
+
+class OrderRepository(ABC):
+    # Settled orders are moved out of the hot collection by archive(). Single-order reads
+    # and all writes fall back to the archive; listings only include it when asked to.
+
+    @abstractmethod
+    async def insert(self, order: dict): ...
+
+    # Unordered: every order is attempted; returns the indexes of those that failed
+    @abstractmethod
+    async def insert_many(self, orders: List[dict]) -> List[int]: ...
+
+    @abstractmethod
+    async def get(self, order_id: str, fields: Optional[dict] = None, include_archived: bool = False) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def get_many(self, order_ids: List[str], fields: Optional[dict] = None,
+                       include_archived: bool = False) -> List[dict]: ...
+
+    # Newest first; `after` is the (created_at, id) keyset cursor of the previous page
+    @abstractmethod
+    async def list(self, filters: OrderFilter, after: Optional[Tuple[datetime, str]], limit: int,
+                   fields: Optional[dict] = None, include_archived: bool = False) -> List[dict]: ...
+
+    @abstractmethod
+    async def list_by_client(self, client_key: str, limit: int, fields: Optional[dict] = None,
+                             include_archived: bool = False) -> List[dict]: ...
+
+    @abstractmethod
+    def iterate(self, filters: OrderFilter, fields: Optional[dict] = None,
+                include_archived: bool = False) -> AsyncIterator[dict]: ...
+
+    # Newest first; orders with, for every term, a search key starting with it
+    @abstractmethod
+    async def search(self, terms: List[str], limit: int, fields: Optional[dict] = None,
+                     include_archived: bool = False) -> List[dict]: ...
+
+    # Returns the document as it was before the change, or None if it doesn't exist
+    @abstractmethod
+    async def update(self, order_id: str, changes: dict, fields: Optional[dict] = None) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def update_many(self, order_ids: List[str], changes: dict): ...
+
+    # Applies different changes to each order (order id -> changes) in one batch
+    @abstractmethod
+    async def update_each(self, changes_by_id: Dict[str, dict]): ...
+
+    @abstractmethod
+    async def delete(self, order_id: str, fields: Optional[dict] = None) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def delete_many(self, order_ids: List[str]): ...
+
+    # Moves up to `limit` orders in `statuses` created (and confirmed, if they were) before
+    # `before` into the archive, oldest first; returns how many were moved
+    @abstractmethod
+    async def archive(self, statuses: List[str], before: datetime, limit: int) -> int: ...
+
+    # Returns None when the key was claimed for order_id, else the order id it already maps to
+    @abstractmethod
+    async def claim_idempotency_key(self, key: str, order_id: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def release_idempotency_key(self, key: str): ...
+
+    @abstractmethod
+    async def idempotency_key_claimed(self, key: str) -> bool: ...
+
+    @abstractmethod
+    async def find_card_orders(self, card_hashes: List[str]) -> List[str]: ...
+
+    # card hash -> ids of the orders that used it
+    @abstractmethod
+    async def find_card_uses(self, card_hashes: List[str]) -> Dict[str, List[str]]: ...
+
+    @abstractmethod
+    async def add_card_uses(self, order_id: str, card_hashes: List[str], created_at: datetime): ...
+
+    # (order id, card hashes, created_at) per order, in one write
+    @abstractmethod
+    async def add_card_uses_many(self, uses: List[Tuple[str, List[str], datetime]]): ...
+
+    @abstractmethod
+    async def remove_card_uses(self, order_ids: List[str]): ...
+
+    @abstractmethod
+    async def apply_stats(self, deltas: StatDeltas): ...
+
+    @abstractmethod
+    async def read_stats(self, since_day: str) -> List[dict]: ...
+
+    @abstractmethod
+    async def rebuild_stats(self, stat_keys: Callable[[dict], List[Tuple[str, str]]]) -> int: ...
+
+class SubjectRepository(ABC):
+    @abstractmethod
+    async def list_by_grade(self, grade: str, fields: Optional[dict] = None) -> List[dict]: ...
+
+    @abstractmethod
+    async def insert(self, subject: dict): ...
+
+    # Returns the updated document, or None if it doesn't exist
+    @abstractmethod
+    async def update(self, subject_id: str, changes: dict, fields: Optional[dict] = None) -> Optional[dict]: ...
+
+    # Appends URLs not already present; returns the updated document, or None if it doesn't exist
+    @abstractmethod
+    async def add_image_urls(self, subject_id: str, urls: List[str], fields: Optional[dict] = None) -> Optional[dict]: ...
+
+    # Upserts subjects keyed on (grade, name) and removes previously seeded ones not listed
+    @abstractmethod
+    async def seed(self, subjects: List[dict]): ...
+
+class MetaRepository(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def set(self, key: str, values: dict): ...
+
+    @abstractmethod
+    async def increment(self, key: str, field: str) -> int: ...
+
+class NotificationRepository(ABC):
+    @abstractmethod
+    async def insert(self, notification: dict): ...
+
+    # Claims the oldest pending (or abandoned "sending") notification due by `now`
+    @abstractmethod
+    async def claim_due(self, now: datetime, lease_until: datetime) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def update(self, notification_id: str, changes: dict): ...
+
+class FulfillmentRepository(ABC):
+    # Returns False if the order already has a fulfillment job
+    @abstractmethod
+    async def create(self, job: dict) -> bool: ...
+
+    # Creates the jobs whose orders have none yet; returns how many were created
+    @abstractmethod
+    async def create_many(self, jobs: List[dict]) -> int: ...
+
+    @abstractmethod
+    async def get(self, order_id: str) -> Optional[dict]: ...
+
+    # Claims the oldest pending (or abandoned "running") job due by `now`
+    @abstractmethod
+    async def claim_due(self, now: datetime, lease_until: datetime) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def update(self, order_id: str, changes: dict): ...
+
+class Storage:
+    orders: OrderRepository
+    subjects: SubjectRepository
+    meta: MetaRepository
+    notifications: NotificationRepository
+    fulfillments: FulfillmentRepository
+
+    async def ensure_indexes(self):
+        pass
+
+    def close(self):
+        pass
+
+def only_duplicate_key_errors(error: BulkWriteError) -> bool:
+    return all(err.get("code") == DUPLICATE_KEY_ERROR for err in error.details.get("writeErrors", []))
+
+def order_sort_key(order: dict) -> tuple:
+    return (order.get("created_at") or datetime.min, order.get("id") or "")
+
+def merge_newest_first(hot: List[dict], archived: List[dict], limit: Optional[int] = None) -> List[dict]:
+    merged = list(heapq.merge(hot, archived, key=order_sort_key, reverse=True))
+    return merged[:limit] if limit is not None else merged
+
+async def merge_iterators_newest_first(hot: AsyncIterator[dict], archived: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    a = await anext(hot, None)
+    b = await anext(archived, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and order_sort_key(a) >= order_sort_key(b)):
+            yield a
+            a = await anext(hot, None)
+        else:
+            yield b
+            b = await anext(archived, None)
+
+# MongoDB (Motor) backend
+
+ORDER_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True),
+    IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+    IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    IndexModel([("client_key", ASCENDING), ("created_at", DESCENDING)]),
+    # Multikey; anchored regexes (prefix search) use it as a range scan
+    IndexModel([("search_keys", ASCENDING)]),
+]
+SUBJECT_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True),
+    IndexModel([("grade", ASCENDING)]),
+    IndexModel([("grade", ASCENDING), ("name", ASCENDING)], unique=True),
+]
+CARD_USE_INDEXES = [
+    IndexModel([("card_hash", ASCENDING), ("order_id", ASCENDING)], unique=True),
+    IndexModel([("order_id", ASCENDING)]),
+]
+def notification_indexes(retention: Optional[int]) -> List[IndexModel]:
+    # Settled notifications (completed_at set) expire after `retention` seconds via a TTL index
+    indexes = [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+    ]
+    if retention is not None:
+        indexes.append(IndexModel([("completed_at", ASCENDING)], expireAfterSeconds=retention))
+    return indexes
+
+FULFILLMENT_INDEXES = [
+    IndexModel([("order_id", ASCENDING)], unique=True),
+    IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+]
+
+def idempotency_indexes(ttl: int) -> List[IndexModel]:
+    # Keys expire after `ttl` seconds via a TTL index
+    return [
+        IndexModel([("key", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=ttl),
+    ]
+
+def orders_query(filters: OrderFilter, after: Optional[Tuple[datetime, str]] = None) -> dict:
+    query = {}
+    if filters.status:
+        query["status"] = filters.status
+    if filters.grade:
+        query["grade"] = filters.grade
+    if filters.purchase_type:
+        query["purchase_type"] = filters.purchase_type
+    if filters.created_from or filters.created_to:
+        query["created_at"] = {}
+        if filters.created_from:
+            query["created_at"]["$gte"] = filters.created_from
+        if filters.created_to:
+            query["created_at"]["$lt"] = filters.created_to
+    if filters.search_version_not is not None:
+        query["search_version"] = {"$ne": filters.search_version_not}
+    if after:
+        created_at, order_id = after
+        keyset = {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": order_id}},
+        ]}
+        query = {"$and": [query, keyset]} if query else keyset
+    return query
+
+def search_query(terms: List[str]) -> dict:
+    return {"$and": [{"search_keys": {"$regex": f"^{re.escape(term)}"}} for term in terms]}
+
+def archive_query(statuses: List[str], before: datetime) -> dict:
+    # Rejected orders carry no confirmed_at
+    return {
+        "status": {"$in": statuses},
+        "created_at": {"$lt": before},
+        "$or": [{"confirmed_at": None}, {"confirmed_at": {"$lt": before}}],
+    }
+
+def without_id(fields: Optional[dict]) -> dict:
+    return fields if fields is not None else {"_id": 0}
+
+def orders_write_concern(w: Optional[str], journal: Optional[bool], wtimeout_ms: Optional[int]) -> Optional[WriteConcern]:
+    # None keeps the server/connection-string default
+    if w is None and journal is None and wtimeout_ms is None:
+        return None
+    if w is not None and w.isdigit():
+        w = int(w)
+    if w == 0:
+        # Order writes rely on acknowledged results (returned documents, duplicate keys)
+        raise ValueError("Unacknowledged writes (w=0) are not supported for orders")
+    return WriteConcern(w=w, j=journal, wtimeout=wtimeout_ms)
+
+class MotorOrderRepository(OrderRepository):
+    EXPORT_BATCH_SIZE = 500
+
+    def __init__(self, db, write_concern: Optional[WriteConcern] = None):
+        self.collection = db.get_collection("orders", write_concern=write_concern)
+        self.archived = db.get_collection("orders_archive", write_concern=write_concern)
+        self.idempotency_keys = db.idempotency_keys
+        self.card_uses = db.card_uses
+        self.order_stats = db.order_stats
+
+    async def insert(self, order: dict):
+        # Insert a copy so the caller's dict doesn't pick up Mongo's ObjectId
+        await self.collection.insert_one({**order})
+
+    async def insert_many(self, orders):
+        if not orders:
+            return []
+        try:
+            await self.collection.insert_many([{**order} for order in orders], ordered=False)
+            return []
+        except BulkWriteError as e:
+            return sorted(err["index"] for err in e.details.get("writeErrors", []))
+
+    async def get(self, order_id, fields=None, include_archived=False):
+        order = await self.collection.find_one({"id": order_id}, without_id(fields))
+        if order is None and include_archived:
+            order = await self.archived.find_one({"id": order_id}, without_id(fields))
+        return order
+
+    async def get_many(self, order_ids, fields=None, include_archived=False):
+        orders = await self.collection.find(
+            {"id": {"$in": order_ids}}, without_id(fields)
+        ).sort(ORDERS_SORT).to_list(len(order_ids))
+        if include_archived and len(orders) < len(set(order_ids)):
+            found = {order.get("id") for order in orders}
+            missing = [order_id for order_id in order_ids if order_id not in found]
+            archived = await self.archived.find(
+                {"id": {"$in": missing}}, without_id(fields)
+            ).sort(ORDERS_SORT).to_list(len(missing))
+            orders = merge_newest_first(orders, archived)
+        return orders
+
+    async def list(self, filters, after, limit, fields=None, include_archived=False):
+        query = orders_query(filters, after)
+        collections = (self.collection, self.archived) if include_archived else (self.collection,)
+        pages = await asyncio.gather(*[
+            collection.find(query, without_id(fields)).sort(ORDERS_SORT).limit(limit).to_list(limit)
+            for collection in collections
+        ])
+        return merge_newest_first(*pages, limit=limit) if include_archived else pages[0]
+
+    async def list_by_client(self, client_key, limit, fields=None, include_archived=False):
+        collections = (self.collection, self.archived) if include_archived else (self.collection,)
+        pages = await asyncio.gather(*[
+            collection.find({"client_key": client_key}, without_id(fields)).sort("created_at", DESCENDING).to_list(limit)
+            for collection in collections
+        ])
+        return merge_newest_first(*pages, limit=limit) if include_archived else pages[0]
+
+    async def iterate(self, filters, fields=None, include_archived=False):
+        if include_archived:
+            orders = merge_iterators_newest_first(
+                self.iterate_collection(self.collection, filters, fields),
+                self.iterate_collection(self.archived, filters, fields),
+            )
+        else:
+            orders = self.iterate_collection(self.collection, filters, fields)
+        async for order in orders:
+            yield order
+
+    async def iterate_collection(self, collection, filters, fields):
+        cursor = collection.find(orders_query(filters), without_id(fields))
+        async for order in cursor.sort(ORDERS_SORT).batch_size(self.EXPORT_BATCH_SIZE):
+            yield order
+
+    async def search(self, terms, limit, fields=None, include_archived=False):
+        collections = (self.collection, self.archived) if include_archived else (self.collection,)
+        pages = await asyncio.gather(*[
+            collection.find(search_query(terms), without_id(fields)).sort(ORDERS_SORT).limit(limit).to_list(limit)
+            for collection in collections
+        ])
+        return merge_newest_first(*pages, limit=limit) if include_archived else pages[0]
+
+    async def update(self, order_id, changes, fields=None):
+        for collection in (self.collection, self.archived):
+            previous = await collection.find_one_and_update(
+                {"id": order_id},
+                {"$set": changes},
+                projection=without_id(fields),
+                return_document=ReturnDocument.BEFORE,
+            )
+            if previous is not None:
+                return previous
+        return None
+
+    async def update_many(self, order_ids, changes):
+        if not order_ids:
+            return
+        operations = [UpdateOne({"id": order_id}, {"$set": changes}) for order_id in order_ids]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        if result.matched_count < len(order_ids):
+            await self.archived.bulk_write(operations, ordered=False)
+
+    async def update_each(self, changes_by_id):
+        if not changes_by_id:
+            return
+        operations = [UpdateOne({"id": order_id}, {"$set": changes}) for order_id, changes in changes_by_id.items()]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        if result.matched_count < len(operations):
+            await self.archived.bulk_write(operations, ordered=False)
+
+    async def delete(self, order_id, fields=None):
+        for collection in (self.collection, self.archived):
+            deleted = await collection.find_one_and_delete({"id": order_id}, projection=without_id(fields))
+            if deleted is not None:
+                return deleted
+        return None
+
+    async def delete_many(self, order_ids):
+        if not order_ids:
+            return
+        operations = [DeleteOne({"id": order_id}) for order_id in order_ids]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        if result.deleted_count < len(order_ids):
+            await self.archived.bulk_write(operations, ordered=False)
+
+    async def archive(self, statuses, before, limit):
+        query = archive_query(statuses, before)
+        batch = await self.collection.find(query).sort("created_at", ASCENDING).limit(limit).to_list(limit)
+        if not batch:
+            return 0
+        # Copy first, then remove: a crash in between leaves both copies, and the re-run
+        # replaces the archived one. Upserts keep the original _id.
+        await self.archived.bulk_write(
+            [ReplaceOne({"id": order["id"]}, order, upsert=True) for order in batch], ordered=False
+        )
+        # Each delete matches the whole document, so an order edited since it was read stays
+        # hot, and its now stale archived copy is dropped
+        result = await self.collection.bulk_write([DeleteOne(order) for order in batch], ordered=False)
+        if result.deleted_count < len(batch):
+            kept = await self.collection.find(
+                {"id": {"$in": [order["id"] for order in batch]}}, {"_id": 0, "id": 1}
+            ).to_list(None)
+            await self.archived.delete_many({"id": {"$in": [order["id"] for order in kept]}})
+        return result.deleted_count
+
+    async def claim_idempotency_key(self, key, order_id):
+        try:
+            await self.idempotency_keys.insert_one({"key": key, "order_id": order_id, "created_at": datetime.utcnow()})
+            return None
+        except DuplicateKeyError:
+            claimed = await self.idempotency_keys.find_one({"key": key})
+            # The key can expire between the insert and this read
+            return claimed["order_id"] if claimed else ""
+
+    async def release_idempotency_key(self, key):
+        await self.idempotency_keys.delete_one({"key": key})
+
+    async def idempotency_key_claimed(self, key):
+        return await self.idempotency_keys.find_one({"key": key}, {"_id": 1}) is not None
+
+    async def find_card_orders(self, card_hashes):
+        if not card_hashes:
+            return []
+        uses = await self.card_uses.find(
+            {"card_hash": {"$in": card_hashes}}, {"_id": 0, "order_id": 1}
+        ).to_list(None)
+        return list(dict.fromkeys(use["order_id"] for use in uses))
+
+    async def find_card_uses(self, card_hashes):
+        if not card_hashes:
+            return {}
+        uses = await self.card_uses.find(
+            {"card_hash": {"$in": card_hashes}}, {"_id": 0, "card_hash": 1, "order_id": 1}
+        ).to_list(None)
+        order_ids = defaultdict(list)
+        for use in uses:
+            order_ids[use["card_hash"]].append(use["order_id"])
+        return dict(order_ids)
+
+    async def add_card_uses(self, order_id, card_hashes, created_at):
+        await self.add_card_uses_many([(order_id, card_hashes, created_at)])
+
+    async def add_card_uses_many(self, uses):
+        documents = [
+            {"card_hash": h, "order_id": order_id, "created_at": created_at}
+            for order_id, card_hashes, created_at in uses
+            for h in card_hashes
+        ]
+        if not documents:
+            return
+        try:
+            await self.card_uses.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Already indexed (e.g. a backfill re-run)
+            if not only_duplicate_key_errors(e):
+                raise
+
+    async def remove_card_uses(self, order_ids):
+        await self.card_uses.delete_many({"order_id": {"$in": order_ids}})
+
+    async def apply_stats(self, deltas):
+        operations = [
+            UpdateOne(
+                {"_id": f"{dimension}:{key}"},
+                {"$inc": {"count": count, "revenue": revenue}, "$set": {"dimension": dimension, "key": key}},
+                upsert=True,
+            )
+            for (dimension, key), (count, revenue) in deltas.items()
+        ]
+        if operations:
+            await self.order_stats.bulk_write(operations, ordered=False)
+
+    async def read_stats(self, since_day):
+        return await self.order_stats.find(
+            {"$or": [{"dimension": {"$ne": "day"}}, {"dimension": "day", "key": {"$gte": since_day}}]},
+            {"_id": 0},
+        ).to_list(None)
+
+    async def rebuild_stats(self, stat_keys):
+        # Same dimensions as stat_keys(), computed server-side in one aggregation per
+        # collection (hot and archive), then added up
+        group = {"count": {"$sum": 1}, "revenue": {"$sum": {"$ifNull": ["$total_amount", 0]}}}
+        pipeline = [{"$facet": {
+            "total": [{"$group": {"_id": "all", **group}}],
+            "grade": [{"$group": {"_id": "$grade", **group}}],
+            "status": [{"$group": {"_id": "$status", **group}}],
+            "purchase_type": [{"$group": {"_id": "$purchase_type", **group}}],
+            "day": [{"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, **group}}],
+        }}]
+        results = await asyncio.gather(*[
+            collection.aggregate(pipeline).to_list(1) for collection in (self.collection, self.archived)
+        ])
+        totals = {}
+        for facets in results:
+            for dimension, rows in facets[0].items():
+                for row in rows:
+                    counter = totals.setdefault((dimension, row["_id"]), [0, 0])
+                    counter[0] += row["count"]
+                    counter[1] += row["revenue"]
+        counters = [
+            {"_id": f"{dimension}:{key}", "dimension": dimension, "key": key, "count": count, "revenue": revenue}
+            for (dimension, key), (count, revenue) in totals.items()
+        ]
+        # Replaced in place rather than dropped and re-inserted, so $inc upserts racing with
+        # the rebuild never hit a missing or duplicate counter; stale counters go last
+        if counters:
+            await self.order_stats.bulk_write(
+                [ReplaceOne({"_id": counter["_id"]}, counter, upsert=True) for counter in counters], ordered=False,
+            )
+        await self.order_stats.delete_many({"_id": {"$nin": [counter["_id"] for counter in counters]}})
+        return len(counters)
+
+class MotorSubjectRepository(SubjectRepository):
+    def __init__(self, db):
+        self.collection = db.subjects
+
+    async def list_by_grade(self, grade, fields=None):
+        return await self.collection.find({"grade": grade}, without_id(fields)).to_list(1000)
+
+    async def insert(self, subject):
+        await self.collection.insert_one({**subject})
+
+    async def update(self, subject_id, changes, fields=None):
+        return await self.collection.find_one_and_update(
+            {"id": subject_id},
+            {"$set": changes},
+            projection=without_id(fields),
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def add_image_urls(self, subject_id, urls, fields=None):
+        return await self.collection.find_one_and_update(
+            {"id": subject_id},
+            {"$addToSet": {"image_urls": {"$each": urls}}},
+            projection=without_id(fields),
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def seed(self, subjects):
+        operations = []
+        names_by_grade = defaultdict(list)
+        for subject in subjects:
+            names_by_grade[subject["grade"]].append(subject["name"])
+            on_insert = {k: v for k, v in subject.items() if k not in ("grade", "name")}
+            # Subjects an admin edited (seeded: False) are left alone; the upsert then hits
+            # the unique (grade, name) index and is ignored below
+            operations.append(UpdateOne(
+                {"grade": subject["grade"], "name": subject["name"], "seeded": {"$ne": False}},
+                {"$setOnInsert": on_insert, "$set": {"seeded": True}},
+                upsert=True,
+            ))
+        for grade, names in names_by_grade.items():
+            operations.append(DeleteMany({"grade": grade, "seeded": True, "name": {"$nin": names}}))
+
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Another worker upserted the same subject concurrently; the unique index kept one copy
+            if not only_duplicate_key_errors(e):
+                raise
+
+class MotorMetaRepository(MetaRepository):
+    def __init__(self, db):
+        self.collection = db.meta
+
+    async def get(self, key):
+        return await self.collection.find_one({"_id": key})
+
+    async def set(self, key, values):
+        await self.collection.update_one({"_id": key}, {"$set": values}, upsert=True)
+
+    async def increment(self, key, field):
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {field: 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc[field]
+
+class MotorNotificationRepository(NotificationRepository):
+    def __init__(self, db):
+        self.collection = db.notifications
+
+    async def insert(self, notification):
+        await self.collection.insert_one({**notification})
+
+    async def claim_due(self, now, lease_until):
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": ["pending", "sending"]}, "next_attempt_at": {"$lte": now}},
+            {"$set": {"status": "sending", "next_attempt_at": lease_until}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def update(self, notification_id, changes):
+        await self.collection.update_one({"id": notification_id}, {"$set": changes})
+
+class MotorFulfillmentRepository(FulfillmentRepository):
+    def __init__(self, db):
+        self.collection = db.fulfillments
+
+    async def create(self, job):
+        try:
+            await self.collection.insert_one({**job})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def create_many(self, jobs):
+        if not jobs:
+            return 0
+        try:
+            result = await self.collection.insert_many([{**job} for job in jobs], ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Orders that already have a job keep it
+            if not only_duplicate_key_errors(e):
+                raise
+            return e.details.get("nInserted", 0)
+
+    async def get(self, order_id):
+        return await self.collection.find_one({"order_id": order_id}, {"_id": 0})
+
+    async def claim_due(self, now, lease_until):
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": ["pending", "running"]}, "next_attempt_at": {"$lte": now}},
+            {"$set": {"status": "running", "next_attempt_at": lease_until}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def update(self, order_id, changes):
+        await self.collection.update_one({"order_id": order_id}, {"$set": changes})
+
+class MotorStorage(Storage):
+    def __init__(self, db, idempotency_ttl: int, notification_retention: Optional[int] = None,
+                 orders_write_concern: Optional[WriteConcern] = None):
+        self.db = db
+        self.idempotency_ttl = idempotency_ttl
+        self.notification_retention = notification_retention
+        self.orders = MotorOrderRepository(db, orders_write_concern)
+        self.subjects = MotorSubjectRepository(db)
+        self.meta = MotorMetaRepository(db)
+        self.notifications = MotorNotificationRepository(db)
+        self.fulfillments = MotorFulfillmentRepository(db)
+
+    async def ensure_indexes(self):
+        # create_indexes is a no-op when the indexes already exist
+        collections = (
+            (self.db.orders, ORDER_INDEXES),
+            (self.db.orders_archive, ORDER_INDEXES),
+            (self.db.subjects, SUBJECT_INDEXES),
+            (self.db.notifications, notification_indexes(self.notification_retention)),
+            (self.db.fulfillments, FULFILLMENT_INDEXES),
+            (self.db.idempotency_keys, idempotency_indexes(self.idempotency_ttl)),
+            (self.db.card_uses, CARD_USE_INDEXES),
+        )
+        for collection, indexes in collections:
+            try:
+                await collection.create_indexes(indexes)
+            except OperationFailure as e:
+                # e.g. duplicate ids in legacy data; keep serving and let the admin fix it
+                logger.error("Failed to create indexes on %s: %s", collection.name, e)
+
+    def close(self):
+        self.db.client.close()
+
+# In-memory backend. Single event loop, no awaits inside mutations, so every method is
+# atomic the way a single Mongo operation is.
+
+def project(doc: dict, fields: Optional[dict]) -> dict:
+    if fields is None:
+        return dict(doc)
+    included = [field for field, include in fields.items() if include and field != "_id"]
+    if not included:
+        # Exclusion projection, e.g. {"_id": 0, "search_keys": 0}
+        return {field: value for field, value in doc.items() if fields.get(field, 1)}
+    return {field: doc[field] for field in included if field in doc}
+
+def search_matches(order: dict, terms: List[str]) -> bool:
+    keys = order.get("search_keys") or ()
+    return all(any(key.startswith(term) for key in keys) for term in terms)
+
+def order_matches(order: dict, filters: OrderFilter) -> bool:
+    created_at = order.get("created_at")
+    return (
+        (not filters.status or order.get("status") == filters.status)
+        and (not filters.grade or order.get("grade") == filters.grade)
+        and (not filters.purchase_type or order.get("purchase_type") == filters.purchase_type)
+        and (not filters.created_from or created_at >= filters.created_from)
+        and (not filters.created_to or created_at < filters.created_to)
+        and (filters.search_version_not is None or order.get("search_version") != filters.search_version_not)
+    )
+
+def archivable(order: dict, statuses: List[str], before: datetime) -> bool:
+    confirmed_at = order.get("confirmed_at")
+    return (
+        order.get("status") in statuses
+        and order["created_at"] < before
+        and (confirmed_at is None or confirmed_at < before)
+    )
+
+class MemoryOrderTable:
+    # One collection's worth of orders with the indexes the queries need
+    YIELD_EVERY = 500
+
+    def __init__(self):
+        self.orders = {}
+        self.keys = []  # sorted (created_at, id), i.e. oldest first
+        self.by_client = defaultdict(set)
+
+    def add(self, order: dict):
+        self.orders[order["id"]] = order
+        insort(self.keys, order_sort_key(order))
+        if order.get("client_key"):
+            self.by_client[order["client_key"]].add(order["id"])
+
+    def remove(self, order_id: str) -> Optional[dict]:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        del self.keys[bisect_left(self.keys, order_sort_key(order))]
+        if order.get("client_key"):
+            self.by_client[order["client_key"]].discard(order_id)
+        return order
+
+    def get_many(self, order_ids, fields):
+        orders = [self.orders[order_id] for order_id in set(order_ids) if order_id in self.orders]
+        return [project(order, fields) for order in sorted(orders, key=order_sort_key, reverse=True)]
+
+    def list(self, filters, after, limit, fields):
+        end = bisect_left(self.keys, after) if after else len(self.keys)
+        results = []
+        for index in range(end - 1, -1, -1):
+            order = self.orders[self.keys[index][1]]
+            if order_matches(order, filters):
+                results.append(project(order, fields))
+                if len(results) == limit:
+                    break
+        return results
+
+    def list_by_client(self, client_key, limit, fields):
+        orders = [self.orders[order_id] for order_id in self.by_client.get(client_key, ())]
+        orders.sort(key=order_sort_key, reverse=True)
+        return [project(order, fields) for order in orders[:limit]]
+
+    def search(self, terms, limit, fields):
+        results = []
+        for _, order_id in reversed(self.keys):
+            order = self.orders[order_id]
+            if search_matches(order, terms):
+                results.append(project(order, fields))
+                if len(results) == limit:
+                    break
+        return results
+
+    async def iterate(self, filters, fields):
+        for count, (_, order_id) in enumerate(reversed(list(self.keys))):
+            order = self.orders.get(order_id)
+            if order and order_matches(order, filters):
+                yield project(order, fields)
+            if count % self.YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+class MemoryOrderRepository(OrderRepository):
+    def __init__(self, idempotency_ttl: int):
+        self.idempotency_ttl = timedelta(seconds=idempotency_ttl)
+        self.hot = MemoryOrderTable()
+        self.archived = MemoryOrderTable()
+        self.idempotency_keys = {}  # key -> (order_id, created_at)
+        self.card_uses = defaultdict(dict)  # card hash -> {order_id: created_at}
+        self.order_cards = defaultdict(set)  # order id -> card hashes
+        self.stats = {}  # (dimension, key) -> [count, revenue]
+
+    def tables(self, include_archived: bool) -> tuple:
+        return (self.hot, self.archived) if include_archived else (self.hot,)
+
+    async def insert(self, order):
+        if order["id"] in self.hot.orders or order["id"] in self.archived.orders:
+            raise DuplicateKeyError(f"duplicate order id {order['id']}")
+        self.hot.add(copy.deepcopy(order))
+
+    async def insert_many(self, orders):
+        failed = []
+        for index, order in enumerate(orders):
+            try:
+                await self.insert(order)
+            except DuplicateKeyError:
+                failed.append(index)
+        return failed
+
+    async def get(self, order_id, fields=None, include_archived=False):
+        for table in self.tables(include_archived):
+            order = table.orders.get(order_id)
+            if order:
+                return project(order, fields)
+        return None
+
+    async def get_many(self, order_ids, fields=None, include_archived=False):
+        orders = self.hot.get_many(order_ids, fields)
+        if include_archived:
+            orders = merge_newest_first(orders, self.archived.get_many(order_ids, fields))
+        return orders
+
+    async def list(self, filters, after, limit, fields=None, include_archived=False):
+        orders = self.hot.list(filters, after, limit, fields)
+        if include_archived:
+            orders = merge_newest_first(orders, self.archived.list(filters, after, limit, fields), limit)
+        return orders
+
+    async def list_by_client(self, client_key, limit, fields=None, include_archived=False):
+        orders = self.hot.list_by_client(client_key, limit, fields)
+        if include_archived:
+            orders = merge_newest_first(orders, self.archived.list_by_client(client_key, limit, fields), limit)
+        return orders
+
+    async def iterate(self, filters, fields=None, include_archived=False):
+        orders = self.hot.iterate(filters, fields)
+        if include_archived:
+            orders = merge_iterators_newest_first(orders, self.archived.iterate(filters, fields))
+        async for order in orders:
+            yield order
+
+    async def search(self, terms, limit, fields=None, include_archived=False):
+        orders = self.hot.search(terms, limit, fields)
+        if include_archived:
+            orders = merge_newest_first(orders, self.archived.search(terms, limit, fields), limit)
+        return orders
+
+    async def update(self, order_id, changes, fields=None):
+        order = self.hot.orders.get(order_id) or self.archived.orders.get(order_id)
+        if order is None:
+            return None
+        previous = project(order, fields)
+        order.update(copy.deepcopy(changes))
+        return previous
+
+    async def update_many(self, order_ids, changes):
+        for order_id in order_ids:
+            await self.update(order_id, changes, {})
+
+    async def update_each(self, changes_by_id):
+        for order_id, changes in changes_by_id.items():
+            await self.update(order_id, changes, {})
+
+    async def delete(self, order_id, fields=None):
+        order = self.hot.remove(order_id) or self.archived.remove(order_id)
+        return project(order, fields) if order else None
+
+    async def delete_many(self, order_ids):
+        for order_id in order_ids:
+            await self.delete(order_id, {})
+
+    async def archive(self, statuses, before, limit):
+        batch = []
+        for _, order_id in self.hot.keys:
+            if archivable(self.hot.orders[order_id], statuses, before):
+                batch.append(order_id)
+                if len(batch) == limit:
+                    break
+        for order_id in batch:
+            self.archived.add(self.hot.remove(order_id))
+        return len(batch)
+
+    async def claim_idempotency_key(self, key, order_id):
+        now = datetime.utcnow()
+        claimed = self.idempotency_keys.get(key)
+        if claimed and now - claimed[1] < self.idempotency_ttl:
+            return claimed[0]
+        self.idempotency_keys[key] = (order_id, now)
+        return None
+
+    async def release_idempotency_key(self, key):
+        self.idempotency_keys.pop(key, None)
+
+    async def idempotency_key_claimed(self, key):
+        claimed = self.idempotency_keys.get(key)
+        return bool(claimed) and datetime.utcnow() - claimed[1] < self.idempotency_ttl
+
+    async def find_card_orders(self, card_hashes):
+        order_ids = []
+        for card_hash in card_hashes:
+            order_ids.extend(self.card_uses.get(card_hash, ()))
+        return list(dict.fromkeys(order_ids))
+
+    async def find_card_uses(self, card_hashes):
+        return {card_hash: list(self.card_uses[card_hash]) for card_hash in card_hashes if self.card_uses.get(card_hash)}
+
+    async def add_card_uses(self, order_id, card_hashes, created_at):
+        for card_hash in card_hashes:
+            self.card_uses[card_hash][order_id] = created_at
+            self.order_cards[order_id].add(card_hash)
+
+    async def add_card_uses_many(self, uses):
+        for order_id, card_hashes, created_at in uses:
+            await self.add_card_uses(order_id, card_hashes, created_at)
+
+    async def remove_card_uses(self, order_ids):
+        for order_id in order_ids:
+            for card_hash in self.order_cards.pop(order_id, ()):
+                self.card_uses[card_hash].pop(order_id, None)
+
+    async def apply_stats(self, deltas):
+        for stat_key, (count, revenue) in deltas.items():
+            counter = self.stats.setdefault(stat_key, [0, 0])
+            counter[0] += count
+            counter[1] += revenue
+
+    async def read_stats(self, since_day):
+        return [
+            {"dimension": dimension, "key": key, "count": count, "revenue": revenue}
+            for (dimension, key), (count, revenue) in self.stats.items()
+            if dimension != "day" or (key and key >= since_day)
+        ]
+
+    async def rebuild_stats(self, stat_keys):
+        self.stats = {}
+        for order in [*self.hot.orders.values(), *self.archived.orders.values()]:
+            for stat_key in stat_keys(order):
+                counter = self.stats.setdefault(stat_key, [0, 0])
+                counter[0] += 1
+                counter[1] += order.get("total_amount") or 0
+        return len(self.stats)
+
+class MemorySubjectRepository(SubjectRepository):
+    def __init__(self):
+        self.subjects = {}
+
+    def find(self, grade: str, name: str) -> Optional[dict]:
+        return next((s for s in self.subjects.values() if s["grade"] == grade and s["name"] == name), None)
+
+    async def list_by_grade(self, grade, fields=None):
+        return [project(subject, fields) for subject in self.subjects.values() if subject["grade"] == grade]
+
+    async def insert(self, subject):
+        if subject["id"] in self.subjects or self.find(subject["grade"], subject["name"]):
+            raise DuplicateKeyError(f"duplicate subject {subject['grade']} / {subject['name']}")
+        self.subjects[subject["id"]] = copy.deepcopy(subject)
+
+    async def update(self, subject_id, changes, fields=None):
+        subject = self.subjects.get(subject_id)
+        if subject is None:
+            return None
+        existing = self.find(changes.get("grade", subject["grade"]), changes.get("name", subject["name"]))
+        if existing is not None and existing is not subject:
+            raise DuplicateKeyError(f"duplicate subject {existing['grade']} / {existing['name']}")
+        subject.update(copy.deepcopy(changes))
+        return project(subject, fields)
+
+    async def add_image_urls(self, subject_id, urls, fields=None):
+        subject = self.subjects.get(subject_id)
+        if subject is None:
+            return None
+        image_urls = subject.setdefault("image_urls", [])
+        image_urls.extend(url for url in dict.fromkeys(urls) if url not in image_urls)
+        return project(subject, fields)
+
+    async def seed(self, subjects):
+        names_by_grade = defaultdict(set)
+        for subject in subjects:
+            names_by_grade[subject["grade"]].add(subject["name"])
+            existing = self.find(subject["grade"], subject["name"])
+            if existing:
+                if existing.get("seeded") is not False:
+                    existing["seeded"] = True
+            else:
+                self.subjects[subject["id"]] = {**copy.deepcopy(subject), "seeded": True}
+        for subject_id, subject in list(self.subjects.items()):
+            names = names_by_grade.get(subject["grade"])
+            if names is not None and subject.get("seeded") and subject["name"] not in names:
+                del self.subjects[subject_id]
+
+class MemoryMetaRepository(MetaRepository):
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        value = self.values.get(key)
+        return {"_id": key, **value} if value is not None else None
+
+    async def set(self, key, values):
+        self.values.setdefault(key, {}).update(values)
+
+    async def increment(self, key, field):
+        value = self.values.setdefault(key, {})
+        value[field] = value.get(field, 0) + 1
+        return value[field]
+
+class MemoryNotificationRepository(NotificationRepository):
+    def __init__(self, retention: Optional[int] = None):
+        self.retention = timedelta(seconds=retention) if retention is not None else None
+        self.notifications = {}
+
+    def expire(self, now: datetime):
+        # Stands in for the TTL index on completed_at
+        if self.retention is None:
+            return
+        for notification_id, notification in list(self.notifications.items()):
+            completed_at = notification.get("completed_at")
+            if completed_at and now - completed_at >= self.retention:
+                del self.notifications[notification_id]
+
+    async def insert(self, notification):
+        self.notifications[notification["id"]] = copy.deepcopy(notification)
+
+    async def claim_due(self, now, lease_until):
+        self.expire(now)
+        due = [
+            n for n in self.notifications.values()
+            if n["status"] in ("pending", "sending") and n["next_attempt_at"] <= now
+        ]
+        if not due:
+            return None
+        notification = min(due, key=lambda n: n["next_attempt_at"])
+        notification.update({"status": "sending", "next_attempt_at": lease_until})
+        return dict(notification)
+
+    async def update(self, notification_id, changes):
+        if notification_id in self.notifications:
+            self.notifications[notification_id].update(changes)
+
+class MemoryFulfillmentRepository(FulfillmentRepository):
+    def __init__(self):
+        self.jobs = {}
+
+    async def create(self, job):
+        if job["order_id"] in self.jobs:
+            return False
+        self.jobs[job["order_id"]] = copy.deepcopy(job)
+        return True
+
+    async def create_many(self, jobs):
+        created = 0
+        for job in jobs:
+            created += await self.create(job)
+        return created
+
+    async def get(self, order_id):
+        job = self.jobs.get(order_id)
+        return copy.deepcopy(job) if job else None
+
+    async def claim_due(self, now, lease_until):
+        due = [j for j in self.jobs.values() if j["status"] in ("pending", "running") and j["next_attempt_at"] <= now]
+        if not due:
+            return None
+        job = min(due, key=lambda j: j["next_attempt_at"])
+        job.update({"status": "running", "next_attempt_at": lease_until})
+        return copy.deepcopy(job)
+
+    async def update(self, order_id, changes):
+        if order_id in self.jobs:
+            self.jobs[order_id].update(copy.deepcopy(changes))
+
+class MemoryStorage(Storage):
+    def __init__(self, idempotency_ttl: int, notification_retention: Optional[int] = None):
+        self.orders = MemoryOrderRepository(idempotency_ttl)
+        self.subjects = MemorySubjectRepository()
+        self.meta = MemoryMetaRepository()
+        self.notifications = MemoryNotificationRepository(notification_retention)
+        self.fulfillments = MemoryFulfillmentRepository()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+API load test and latency benchmark.
+Runs a weighted mix of catalog browsing, order bursts and admin listing against the
+FastAPI app (in-process via ASGI, or a running server with --url) and reports
+throughput and p50/p95/p99 latency per route. Results are written as JSON so runs
+can be compared across commits.
+
+Usage:
+  python benchmarks/load_test.py                       # in-process, in-memory storage backend
+  python benchmarks/load_test.py --mongo env --db wazari_benchmark   # in-process, MONGO_URL from env
+  python benchmarks/load_test.py --url http://localhost:8001 --duration 30
+  python benchmarks/load_test.py --mix catalog=1 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT_DIR / "benchmarks" / "results"
+DEFAULT_MIX = {"catalog": 6, "orders": 1, "admin": 3}
+
+# --mongo env drops the database before and after the run, so only these names are accepted
+BENCHMARK_DB_MARKER = "bench"
+
+GRADES = ["السادس ابتدائي", "الثالث متوسط", "السادس إعدادي - علمي", "السادس إعدادي - أدبي"]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, http, route, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+# Scenarios: each performs one user-visible interaction (possibly several requests)
+async def browse_catalog(http, recorder, state):
+    await recorder.request(http, "GET /api/grades", "GET", "/api/grades")
+    await recorder.request(http, "GET /api/pricing", "GET", "/api/pricing")
+    grade = random.choice(GRADES)
+    headers = {}
+    etag = state["etags"].get(grade)
+    if etag and random.random() < 0.5:
+        # Repeat visitor revalidating its cached copy
+        headers["If-None-Match"] = etag
+    response = await recorder.request(http, "GET /api/subjects/{grade}", "GET", f"/api/subjects/{grade}", headers=headers)
+    if response is not None and response.status_code == 200:
+        state["etags"][grade] = response.headers.get("etag")
+        state["subjects"][grade] = [subject["id"] for subject in response.json()]
+
+async def place_order(http, recorder, state):
+    grade = random.choice(GRADES)
+    subjects = state["subjects"].get(grade) or []
+    purchase_type = "all" if random.random() < 0.3 else "single"
+    payload = {
+        "student_name": f"طالب {random.randint(1, 10**6)}",
+        "contact_method": "telegram",
+        "contact_value": f"@bench{random.randint(1, 10**6)}",
+        "client_key": f"ck_bench_{random.randint(1, 5000)}",
+        "grade": grade,
+        "purchase_type": purchase_type,
+        "selected_subjects": random.sample(subjects, min(len(subjects), 2)) if purchase_type == "single" else [],
+        "card_numbers": [str(random.randint(10**11, 10**12 - 1))],
+    }
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    await recorder.request(http, "POST /api/orders", "POST", "/api/orders", json=payload, headers=headers)
+
+async def admin_listing(http, recorder, state):
+    response = await recorder.request(http, "GET /api/orders", "GET", "/api/orders", params={"limit": 50})
+    if response is not None and response.status_code == 200:
+        cursor = response.json().get("next_cursor")
+        if cursor:
+            await recorder.request(http, "GET /api/orders", "GET", "/api/orders", params={"limit": 50, "cursor": cursor})
+    await recorder.request(http, "GET /api/orders?order_status=", "GET", "/api/orders",
+                           params={"order_status": "pending", "limit": 50})
+    await recorder.request(http, "GET /api/stats", "GET", "/api/stats")
+
+SCENARIOS = {"catalog": browse_catalog, "orders": place_order, "admin": admin_listing}
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = sorted(recorder.latencies[route])
+        routes[route] = {
+            "count": len(values),
+            "errors": recorder.errors[route],
+            "rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    total = sum(route["count"] for route in routes.values())
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "rps": round(total / elapsed, 2),
+        "routes": routes,
+    }
+
+async def worker(http, recorder, state, mix, deadline):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        await SCENARIOS[random.choices(names, weights)[0]](http, recorder, state)
+
+async def seed_orders(server, count):
+    now = datetime.utcnow()
+    orders = []
+    for i in range(count):
+        orders.append({
+            "id": str(uuid.uuid4()),
+            "student_name": f"طالب {i}",
+            "telegram_username": "",
+            "phone_number": "",
+            "email": "",
+            "contact_method": "telegram",
+            "contact_value": f"@seed{i}",
+            "client_key": f"ck_seed_{i % 500}",
+            "grade": GRADES[i % len(GRADES)],
+            "purchase_type": "all" if i % 3 == 0 else "single",
+            "selected_subjects": [],
+            "card_numbers": [str(10**11 + i)],
+            "card_numbers_masked": [f"•••• {str(10**11 + i)[-4:]}"],
+            "total_amount": 50 if i % 3 == 0 else 10,
+            "status": ["pending", "confirmed", "rejected"][i % 3],
+            "created_at": now - timedelta(minutes=i),
+            "confirmed_at": None,
+            "suspected_duplicate": False,
+            "duplicate_of": [],
+        })
+    for order in orders:
+        await server.storage.orders.insert(order)
+    await server.rebuild_order_stats(server.storage)
+
+async def in_process_app(args):
+    # server.py reads configuration at import time
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    if args.mongo == "env":
+        os.environ["DB_NAME"] = args.db
+    os.environ["ADMISSION_ENABLED"] = "false"
+    os.environ["STORAGE_BACKEND"] = "memory" if args.mongo == "memory" else "mongo"
+    sys.path.insert(0, str(ROOT_DIR / "backend"))
+    import server
+
+    if args.mongo == "env":
+        await server.client.drop_database(args.db)
+
+    # Startup without the Telegram outbox worker: notifications just accumulate
+    await server.storage.ensure_indexes()
+    await server.init_default_subjects(server.storage)
+    await seed_orders(server, args.seed_orders)
+    return server
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+async def run(args):
+    if args.url:
+        transport = None
+        base_url = args.url.rstrip("/")
+        server = None
+    else:
+        server = await in_process_app(args)
+        transport = httpx.ASGITransport(app=server.app)
+        base_url = "http://benchmark"
+
+    recorder = Recorder()
+    state = {"etags": {}, "subjects": {}}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits, timeout=30) as http:
+        # Warm-up populates ETags/subject ids and is not recorded
+        warmup = Recorder()
+        for _ in range(len(GRADES) * 2):
+            await browse_catalog(http, warmup, state)
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*[worker(http, recorder, state, args.mix, deadline) for _ in range(args.concurrency)])
+        elapsed = time.monotonic() - started
+
+    if server is not None and args.mongo == "env":
+        await server.client.drop_database(args.db)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "target": args.url or f"in-process ({args.mongo} storage)",
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "seed_orders": 0 if args.url else args.seed_orders,
+        },
+        **summarize(recorder, elapsed),
+    }
+
+def print_report(result):
+    meta = result["meta"]
+    print(f"target: {meta['target']}  commit: {meta['commit']}  concurrency: {meta['concurrency']}")
+    print(f"{'route':38} {'count':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in result["routes"].items():
+        print(f"{route:38} {stats['count']:7d} {stats['errors']:5d} {stats['rps']:9.1f} "
+              f"{stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f}")
+    print(f"{'total':38} {result['requests']:7d} {result['errors']:5d} {result['rps']:9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--mongo", choices=["memory", "env"], default="memory",
+                        help="in-process only: in-memory storage backend or the MongoDB from MONGO_URL")
+    parser.add_argument("--db", help=f"database for --mongo env; dropped before and after the run, "
+                                     f"so its name must contain {BENCHMARK_DB_MARKER!r}")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. catalog=6,orders=1,admin=3")
+    parser.add_argument("--seed-orders", type=int, default=1000, help="orders inserted before the run (in-process)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--output", type=Path, help="result file (default: benchmarks/results/<time>-<commit>.json)")
+    args = parser.parse_args()
+    if args.mongo == "env" and not args.db:
+        parser.error("--mongo env requires --db")
+    if args.db and BENCHMARK_DB_MARKER not in args.db.lower():
+        parser.error(f"refusing to drop {args.db!r}: benchmark database names must contain {BENCHMARK_DB_MARKER!r}")
+
+    # httpx logs every request at INFO, which would flood the report and skew latencies
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    random.seed(args.seed)
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = RESULTS_DIR / f"{datetime.utcnow():%Y%m%d-%H%M%S}-{result['meta']['commit'] or 'local'}.json"
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"results written to {output}")
+
+if __name__ == "__main__":
+    main()
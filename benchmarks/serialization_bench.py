@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Order listing serialization benchmark.
+Compares the old read path (Order(**doc) per row, jsonable_encoder, stdlib json)
+with the current one (projected documents straight to orjson) on 10k orders.
+
+Usage: python benchmarks/serialization_bench.py [--rows 10000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bson import ObjectId
+
+# server.py reads these at import time; no connection is made by this script
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from server import Order, ORDER_PROJECTION, GradeType  # noqa: E402
+
+def make_orders(rows):
+    grades = [grade.value for grade in GradeType]
+    start = datetime.utcnow()
+    orders = []
+    for i in range(rows):
+        orders.append({
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "student_name": f"طالب رقم {i}",
+            "telegram_username": f"@student{i}",
+            "phone_number": "07701234567",
+            "email": "",
+            "contact_method": "telegram",
+            "contact_value": f"@student{i}",
+            "client_key": f"ck_{i}",
+            "grade": grades[i % len(grades)],
+            "purchase_type": "single" if i % 3 else "all",
+            "selected_subjects": [str(uuid.uuid4()) for _ in range(i % 4)],
+            "card_numbers": ["123456789012", "987654321098"],
+            "card_numbers_masked": ["•••• 9012", "•••• 1098"],
+            "suspected_duplicate": i % 10 == 0,
+            "duplicate_of": [str(uuid.uuid4())] if i % 10 == 0 else [],
+            "total_amount": 50 if i % 3 == 0 else 10 * (i % 4),
+            "status": "pending",
+            "created_at": start - timedelta(seconds=i),
+            "confirmed_at": None,
+        })
+    return orders
+
+def project(order):
+    return {field: order[field] for field in ORDER_PROJECTION if field != "_id" and field in order}
+
+def old_path(orders):
+    # FastAPI default: model per row, then jsonable_encoder + json.dumps in JSONResponse
+    models = [Order(**order) for order in orders]
+    return json.dumps(jsonable_encoder({"orders": models}), ensure_ascii=False).encode()
+
+def new_path(orders):
+    # Mongo applies the projection; rows are serialized directly
+    return orjson.dumps({"orders": orders})
+
+def best_of(fn, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    orders = make_orders(args.rows)
+    projected = [project(order) for order in orders]
+    assert json.loads(old_path(orders)) == json.loads(new_path(projected)), "payloads differ"
+
+    old = best_of(old_path, orders, args.repeat)
+    new = best_of(new_path, projected, args.repeat)
+    print(f"rows: {args.rows}")
+    print(f"Order(**doc) + jsonable_encoder + json: {old * 1000:8.1f} ms  {old / args.rows * 1e6:6.2f} µs/row")
+    print(f"projection + orjson:                    {new * 1000:8.1f} ms  {new / args.rows * 1e6:6.2f} µs/row")
+    print(f"speedup: {old / new:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -16,15 +16,47 @@ const AdminPage = () => {
   const [searchTerm, setSearchTerm] = useState("");
   const [selectedOrder, setSelectedOrder] = useState(null);
   const [updating, setUpdating] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [counts, setCounts] = useState({ total: 0, pending: 0, confirmed: 0, rejected: 0 });
 
   useEffect(() => {
     fetchOrders();
+  }, [filter]);
+
+  useEffect(() => {
+    fetchCounts();
   }, []);
 
+  useEffect(() => {
+    // Live feed: apply new orders and status changes without refetching the list
+    const source = new EventSource(`${API}/orders/stream`);
+    source.addEventListener("order_created", (e) => {
+      const order = JSON.parse(e.data);
+      setOrders(prev => prev.some(o => o.id === order.id) ? prev : [order, ...prev]);
+      fetchCounts();
+    });
+    source.addEventListener("order_updated", (e) => {
+      const changes = JSON.parse(e.data);
+      setOrders(prev => prev.map(o => o.id === changes.id ? { ...o, ...changes } : o));
+      fetchCounts();
+    });
+    source.addEventListener("order_deleted", (e) => {
+      const { id } = JSON.parse(e.data);
+      setOrders(prev => prev.filter(o => o.id !== id));
+      fetchCounts();
+    });
+    return () => source.close();
+  }, []);
+
+  // The status filter is applied by the server, so every page holds matching orders only
+  const statusParams = () => (filter === "all" ? {} : { order_status: filter });
+
   const fetchOrders = async () => {
     try {
-      const response = await axios.get(`${API}/orders`);
-      setOrders(response.data);
+      const response = await axios.get(`${API}/orders`, { params: statusParams() });
+      setOrders(response.data.orders || []);
+      setNextCursor(response.data.next_cursor || null);
     } catch (error) {
       console.error("Error fetching orders:", error);
     } finally {
@@ -32,6 +64,47 @@ const AdminPage = () => {
     }
   };
 
+  const fetchMoreOrders = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/orders`, { params: { ...statusParams(), cursor: nextCursor } });
+      setOrders(prev => [...prev, ...(response.data.orders || [])]);
+      setNextCursor(response.data.next_cursor || null);
+    } catch (error) {
+      console.error("Error fetching orders:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const fetchCounts = async () => {
+    // Counters over all orders (kept by the server), not just the pages loaded here
+    try {
+      const response = await axios.get(`${API}/stats`, { params: { days: 1 } });
+      const byStatus = response.data.by_status || {};
+      setCounts({
+        total: response.data.total ? response.data.total.count : 0,
+        pending: byStatus.pending ? byStatus.pending.count : 0,
+        confirmed: byStatus.confirmed ? byStatus.confirmed.count : 0,
+        rejected: byStatus.rejected ? byStatus.rejected.count : 0,
+      });
+    } catch (error) {
+      console.error("Error fetching stats:", error);
+    }
+  };
+
+  const handleViewOrder = async (order) => {
+    // Listings carry masked cards only; load the full order for the detail view
+    setSelectedOrder(order);
+    try {
+      const response = await axios.get(`${API}/orders/${order.id}`);
+      setSelectedOrder(response.data);
+    } catch (error) {
+      console.error("Error fetching order:", error);
+    }
+  };
+
   const handleUpdateOrder = async (orderId, status, adminNotes = "") => {
     setUpdating(true);
     try {
@@ -47,6 +120,7 @@ const AdminPage = () => {
           : order
       ));
       
+      fetchCounts();
       setSelectedOrder(null);
       alert(`تم ${status === "confirmed" ? "تأكيد" : "رفض"} الطلب بنجاح`);
     } catch (error) {
@@ -69,6 +143,7 @@ const AdminPage = () => {
       // Remove from local state
       setOrders(prev => prev.filter(order => order.id !== orderId));
       
+      fetchCounts();
       setSelectedOrder(null);
       alert("تم حذف الطلب بنجاح");
     } catch (error) {
@@ -101,7 +176,7 @@ const AdminPage = () => {
     const matchesFilter = filter === "all" || order.status === filter;
     const matchesSearch = order.student_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
                          order.telegram_username.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         order.card_number.includes(searchTerm);
+                         (order.card_numbers_masked || []).join(" ").includes(searchTerm);
     return matchesFilter && matchesSearch;
   });
 
@@ -148,24 +223,24 @@ const AdminPage = () => {
         {/* Stats */}
         <div className="grid grid-cols-1 md:grid-cols-4 gap-6 mb-8">
           <div className="bg-white rounded-lg p-6 shadow-sm">
-            <div className="text-2xl font-bold text-gray-900">{orders.length}</div>
+            <div className="text-2xl font-bold text-gray-900">{counts.total}</div>
             <div className="text-gray-600">إجمالي الطلبات</div>
           </div>
           <div className="bg-white rounded-lg p-6 shadow-sm">
             <div className="text-2xl font-bold text-yellow-600">
-              {orders.filter(o => o.status === "pending").length}
+              {counts.pending}
             </div>
             <div className="text-gray-600">في الانتظار</div>
           </div>
           <div className="bg-white rounded-lg p-6 shadow-sm">
             <div className="text-2xl font-bold text-green-600">
-              {orders.filter(o => o.status === "confirmed").length}
+              {counts.confirmed}
             </div>
             <div className="text-gray-600">مؤكد</div>
           </div>
           <div className="bg-white rounded-lg p-6 shadow-sm">
             <div className="text-2xl font-bold text-red-600">
-              {orders.filter(o => o.status === "rejected").length}
+              {counts.rejected}
             </div>
             <div className="text-gray-600">مرفوض</div>
           </div>
@@ -243,7 +318,10 @@ const AdminPage = () => {
                       ${order.total_amount}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap text-sm font-mono text-gray-900">
-                      {order.card_number}
+                      {(order.card_numbers_masked || []).join(", ")}
+                      {order.suspected_duplicate && (
+                        <div className="text-xs font-sans text-red-600">كارت مستخدم سابقاً</div>
+                      )}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap">
                       <span className={`inline-flex px-2 py-1 text-xs font-semibold rounded-full ${getStatusColor(order.status)}`}>
@@ -256,7 +334,7 @@ const AdminPage = () => {
                     <td className="px-6 py-4 whitespace-nowrap text-sm font-medium">
                       <div className="flex space-x-2">
                         <button
-                          onClick={() => setSelectedOrder(order)}
+                          onClick={() => handleViewOrder(order)}
                           className="text-blue-600 hover:text-blue-900 p-1"
                           data-testid={`view-order-${order.id}`}
                         >
@@ -308,6 +386,19 @@ const AdminPage = () => {
               <p className="mt-1 text-sm text-gray-500">لا توجد طلبات تطابق معايير البحث الخاصة بك.</p>
             </div>
           )}
+
+          {nextCursor && (
+            <div className="text-center py-4 border-t border-gray-200">
+              <button
+                onClick={fetchMoreOrders}
+                disabled={loadingMore}
+                className="px-4 py-2 text-sm font-medium text-blue-600 hover:text-blue-900 disabled:opacity-50"
+                data-testid="load-more-orders"
+              >
+                {loadingMore ? "جاري التحميل..." : "تحميل المزيد"}
+              </button>
+            </div>
+          )}
         </div>
       </div>
 
@@ -325,7 +416,10 @@ const AdminPage = () => {
               <div><strong>نوع الشراء:</strong> {selectedOrder.purchase_type === "all" ? "جميع المواد" : "مواد منفردة"}</div>
               <div><strong>عدد المواد:</strong> {selectedOrder.selected_subjects.length}</div>
               <div><strong>المبلغ:</strong> ${selectedOrder.total_amount}</div>
-              <div><strong>كارت الرصيد:</strong> {selectedOrder.card_number}</div>
+              <div><strong>كارت الرصيد:</strong> {(selectedOrder.card_numbers || selectedOrder.card_numbers_masked || []).join(", ")}</div>
+              {selectedOrder.suspected_duplicate && (
+                <div className="text-red-600"><strong>تنبيه:</strong> الكارت مستخدم في طلب سابق</div>
+              )}
               <div><strong>الحالة:</strong> <span className={`px-2 py-1 rounded text-xs ${getStatusColor(selectedOrder.status)}`}>{getStatusText(selectedOrder.status)}</span></div>
               <div><strong>تاريخ الإنشاء:</strong> {formatDate(selectedOrder.created_at)}</div>
             </div>
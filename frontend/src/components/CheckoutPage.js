@@ -141,10 +141,16 @@ const CheckoutPage = () => {
         card_numbers: formData.cards.map(card => card.number.replace(/\s/g, "")).filter(num => num)
       };
 
+      // One key for the whole retry chain so the server stores at most one order
+      const idempotencyKey = (window.crypto && window.crypto.randomUUID)
+        ? window.crypto.randomUUID()
+        : `idem_${Math.random().toString(36).slice(2)}_${Date.now()}`;
+      const requestConfig = { timeout: 15000, headers: { "Idempotency-Key": idempotencyKey } };
+
       let response;
       try {
         // حاول المسار الأصلي أولاً
-        response = await axios.post(`${API}/orders`, modernPayload, { timeout: 15000 });
+        response = await axios.post(`${API}/orders`, modernPayload, requestConfig);
       } catch (e1) {
         try {
           // جرّب الصيغة القديمة على المسار الأصلي
@@ -157,11 +163,11 @@ const CheckoutPage = () => {
             selected_subjects: orderData.selected_subjects || orderData.selectedSubjects,
             card_number: modernPayload.card_numbers.join(',')
           };
-          response = await axios.post(`${API}/orders`, legacyPayload, { timeout: 15000 });
+          response = await axios.post(`${API}/orders`, legacyPayload, requestConfig);
         } catch (e2) {
           // أخيراً جرّب المسار البسيط
           try {
-            response = await axios.post(`${API}/orders/simple`, modernPayload, { timeout: 15000 });
+            response = await axios.post(`${API}/orders/simple`, modernPayload, requestConfig);
           } catch (e3) {
             const legacyPayload2 = {
               student_name: formData.studentName,
@@ -172,7 +178,7 @@ const CheckoutPage = () => {
               selected_subjects: orderData.selected_subjects || orderData.selectedSubjects,
               card_number: modernPayload.card_numbers.join(',')
             };
-            response = await axios.post(`${API}/orders/simple`, legacyPayload2, { timeout: 15000 });
+            response = await axios.post(`${API}/orders/simple`, legacyPayload2, requestConfig);
           }
         }
       }
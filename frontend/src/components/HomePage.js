@@ -4,6 +4,7 @@ import { BookOpen, GraduationCap, Users, Star, MessageCircle, Phone, Sparkles, A
 import ThemeToggle from "./ThemeToggle";
 import Sidebar from "./Sidebar";
 import axios from "axios";
+import { loadCatalog } from "../lib/catalog";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -23,6 +24,8 @@ const HomePage = () => {
     ];
     setGrades(localGrades);
     setLoading(false);
+    // Warm the catalog so the subjects page renders without another round trip
+    loadCatalog().catch(() => {});
   }, []);
 
   const fetchGrades = async () => {};
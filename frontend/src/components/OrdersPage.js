@@ -15,7 +15,7 @@ const OrdersPage = () => {
   const [searchTerm, setSearchTerm] = useState("");
 
   useEffect(() => {
-    // Filter by local identifier (cookie or localStorage) so the user sees only their orders
+    // Fetch by local identifier (localStorage) so the user sees only their orders
     fetchOrders();
   }, []);
 
@@ -31,12 +31,10 @@ const OrdersPage = () => {
 
   const fetchOrders = async () => {
     try {
-      const response = await axios.get(`${API}/orders`);
-      const all = response.data || [];
       const key = getClientKey();
-      // Show only orders that match this device's client key or contain it in telegram_username (fallback)
-      const mine = all.filter(o => (o.client_key && o.client_key === key) || (o.telegram_username && o.telegram_username.includes(key)));
-      setOrders(mine);
+      // The server returns only this device's orders (matched by client key)
+      const response = await axios.get(`${API}/orders/by-client/${encodeURIComponent(key)}`);
+      setOrders(response.data || []);
     } catch (error) {
       console.error("Error fetching orders:", error);
     } finally {
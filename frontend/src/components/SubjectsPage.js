@@ -4,10 +4,7 @@ import { ArrowRight, BookOpen, Check, ShoppingCart } from "lucide-react";
 import SecurityProtection from "./SecurityProtection";
 import ThemeToggle from "./ThemeToggle";
 import Sidebar from "./Sidebar";
-import axios from "axios";
-
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
-const API = `${BACKEND_URL}/api`;
+import { loadGradeSubjects } from "../lib/catalog";
 
 const SubjectsPage = () => {
   const { grade } = useParams();
@@ -32,8 +29,7 @@ const SubjectsPage = () => {
   const fetchSubjects = async () => {
     try {
       const decodedGrade = decodeURIComponent(grade);
-      const response = await axios.get(`${API}/subjects/${decodedGrade}`);
-      const data = response.data || [];
+      const data = await loadGradeSubjects(decodedGrade);
       if (!data || data.length === 0) throw new Error('empty');
       setSubjects(data);
     } catch (error) {
@@ -0,0 +1,26 @@
+import axios from "axios";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// The whole catalog (grades, their subjects, pricing) comes from one request and is
+// shared by every page for the lifetime of the tab. The browser revalidates it with
+// the ETag, so reloads only transfer it again when the subjects changed.
+let catalogPromise = null;
+
+export function loadCatalog() {
+  if (!catalogPromise) {
+    catalogPromise = axios.get(`${API}/catalog`).then((response) => response.data).catch((error) => {
+      // Let the next caller retry
+      catalogPromise = null;
+      throw error;
+    });
+  }
+  return catalogPromise;
+}
+
+export async function loadGradeSubjects(gradeValue) {
+  const catalog = await loadCatalog();
+  const grade = (catalog.grades || []).find((g) => g.value === gradeValue);
+  return grade ? grade.subjects : [];
+}
@@ -0,0 +1,144 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Read by server at import time: in-memory storage, a local Telegram stub and short timers
+TELEGRAM_STUB_PORT = free_port()
+os.environ.update({
+    "STORAGE_BACKEND": "memory",
+    "TELEGRAM_API_URL": f"http://127.0.0.1:{TELEGRAM_STUB_PORT}",
+    "TELEGRAM_BOT_TOKEN": "test-token",
+    "TELEGRAM_CHAT_ID": "1000",
+    "TELEGRAM_MIN_INTERVAL": "0",
+    "OUTBOX_POLL_INTERVAL": "0.1",
+    "ADMISSION_ENABLED": "false",
+    "ARCHIVE_ENABLED": "false",
+    "METRICS_ENABLED": "false",
+    "ASSETS_DIR": tempfile.mkdtemp(prefix="wazari-assets-"),
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+GRADE = "الثالث متوسط"
+
+
+class TelegramStub:
+    # Records Bot API calls; scripted (status, payload) replies are used first, then 200 OK
+    def __init__(self):
+        self.calls = []
+        self.script = []
+        self.app = FastAPI()
+        self.app.post("/bot{token}/{method}")(self.handle)
+
+    async def handle(self, token: str, method: str, request: Request):
+        self.calls.append((method, await request.body()))
+        if self.script:
+            status_code, payload = self.script.pop(0)
+            return JSONResponse(payload, status_code=status_code)
+        return {"ok": True, "result": {"message_id": len(self.calls)}}
+
+    def reset(self):
+        self.calls.clear()
+        self.script.clear()
+
+
+@pytest.fixture(scope="session")
+def telegram_stub():
+    stub = TelegramStub()
+    stub_server = uvicorn.Server(uvicorn.Config(stub.app, port=TELEGRAM_STUB_PORT, log_level="error"))
+    thread = threading.Thread(target=stub_server.run, daemon=True)
+    thread.start()
+    while not stub_server.started:
+        time.sleep(0.01)
+    yield stub
+    stub_server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(server, "OUTBOX_BACKOFF_BASE", 0.01)
+
+
+@pytest.fixture
+def store():
+    return MemoryStorage(idempotency_ttl=server.IDEMPOTENCY_TTL, notification_retention=server.NOTIFICATION_RETENTION)
+
+
+@pytest.fixture
+def client(store, telegram_stub):
+    # Routes and background workers both get the test's store through the override
+    telegram_stub.reset()
+    server.app.dependency_overrides[server.get_storage] = lambda: store
+    try:
+        with TestClient(server.app) as test_client:
+            yield test_client
+    finally:
+        server.app.dependency_overrides.clear()
+
+
+def order_body(**fields) -> dict:
+    return {"student_name": "طالب", "grade": GRADE, "purchase_type": "all", "card_numbers": ["1234 5678 9012"], **fields}
+
+
+def create_orders(client, count: int, **fields) -> list:
+    ids = []
+    for index in range(count):
+        response = client.post("/api/orders", json=order_body(student_name=f"s{index}", **fields))
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+
+def list_all(client, **params) -> list:
+    # Order ids of every page, following next_cursor
+    seen, cursor = [], None
+    while True:
+        page = client.get("/api/orders", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        seen.extend(order["id"] for order in page["orders"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def notifications(store) -> list:
+    return list(store.notifications.notifications.values())
+
+
+def settled(store) -> list:
+    items = notifications(store)
+    return items if items and all(item["status"] in ("sent", "failed") for item in items) else None
+
+
+def sent_payloads(stub, method: str) -> list:
+    return [json.loads(body) for called, body in stub.calls if called == method]
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.05)
+    raise AssertionError("condition not met in time")
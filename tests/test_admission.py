@@ -0,0 +1,144 @@
+import pytest
+
+import server
+from server import AdmissionController, client_ip
+from tests.conftest import order_body
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(server, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(server, "ADMISSION_BURST", 3.0)
+    monkeypatch.setattr(server, "ADMISSION_IP_BURST", 5.0)
+    monkeypatch.setattr(server, "ADMISSION_BY_IP", False)
+    # The middleware holds the module's controller; start it from empty buckets
+    controller = server.admission
+    controller.buckets.clear()
+    controller.charged_keys.clear()
+    controller.counters.update(admitted=0, shed_rate_limited=0, shed_overloaded=0)
+    return controller
+
+
+def age(controller: AdmissionController, key: str, seconds: float):
+    controller.buckets[key][1] -= seconds
+
+
+def test_token_bucket_allows_a_burst_then_refills(admission):
+    controller = AdmissionController()
+    assert [controller.take_token(["ck:a"]) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert controller.take_token(["ck:a"]) == pytest.approx(1 / server.ADMISSION_RATE, rel=0.01)
+
+    age(controller, "ck:a", 1 / server.ADMISSION_RATE)
+    assert controller.take_token(["ck:a"]) == 0.0
+    assert controller.take_token(["ck:a"]) > 0
+
+
+def test_address_buckets_have_their_own_limits(admission):
+    controller = AdmissionController()
+    assert [controller.take_token(["ip:1"]) for _ in range(6)][-2:] == [0.0, pytest.approx(1 / server.ADMISSION_IP_RATE, rel=0.01)]
+
+
+def test_token_is_taken_only_when_every_bucket_has_one(admission):
+    controller = AdmissionController()
+    for _ in range(3):
+        controller.take_token(["ck:a"])
+
+    assert controller.take_token(["ck:a", "ip:1"]) > 0
+    # The refused request charged nothing and its new bucket isn't remembered
+    assert "ip:1" not in controller.buckets
+    assert controller.take_token(["ip:1"]) == 0.0
+    assert controller.buckets["ip:1"][0] == pytest.approx(4.0)
+
+
+def test_unknown_clients_also_pay_from_their_address(admission):
+    controller = AdmissionController()
+    assert controller.bucket_keys("1.1.1.1", None) == ["ip:1.1.1.1"]
+    assert controller.bucket_keys("1.1.1.1", "a") == ["ck:a", "ip:1.1.1.1"]
+    controller.take_token(["ck:a", "ip:1.1.1.1"])
+    assert controller.bucket_keys("1.1.1.1", "a") == ["ck:a"]
+
+
+def test_buckets_are_bounded(admission, monkeypatch):
+    monkeypatch.setattr(server, "ADMISSION_MAX_CLIENTS", 2)
+    controller = AdmissionController()
+    for key in ("ck:a", "ck:b", "ck:c"):
+        controller.take_token([key])
+    assert list(controller.buckets) == ["ck:b", "ck:c"]
+
+
+def test_client_ip_uses_configured_proxy_hops(monkeypatch):
+    scope = {"client": ("10.0.0.1", 1234), "headers": [(b"x-forwarded-for", b"1.1.1.1, 2.2.2.2, 10.0.0.9")]}
+    assert client_ip(scope) == "10.0.0.1"
+    monkeypatch.setattr(server, "ADMISSION_PROXY_HOPS", 2)
+    assert client_ip(scope) == "2.2.2.2"
+
+
+def post(client, client_key=None, key=None, path="/api/orders", **fields):
+    body = order_body(**({"client_key": client_key} if client_key else {}), **fields)
+    return client.post(path, json=body, headers={"Idempotency-Key": key} if key else {})
+
+
+def test_returning_clients_are_limited_per_client_key(client, admission):
+    assert [post(client, "a", f"a{n}").status_code for n in range(4)] == [200, 200, 200, 429]
+    # "b" is new: its first request also takes the address's second token
+    assert [post(client, "b", f"b{n}").status_code for n in range(3)] == [200, 200, 200]
+
+    refused = post(client, "a", "a9")
+    assert refused.headers["retry-after"] == "5"
+    assert refused.json() == {"detail": "Too many orders, please retry later"}
+
+
+def test_requests_without_client_key_share_the_address_bucket(client, admission):
+    assert [post(client, path="/api/orders/simple").status_code for _ in range(6)] == [200] * 5 + [429]
+
+
+def test_rotating_client_keys_share_the_address_bucket(client, admission):
+    assert [post(client, f"bot{n}").status_code for n in range(6)] == [200] * 5 + [429]
+    # A refused key stays unknown: resending it still pays the address
+    assert post(client, "bot5").status_code == 429
+
+
+def test_every_request_pays_the_address_when_configured(client, admission, monkeypatch):
+    monkeypatch.setattr(server, "ADMISSION_BY_IP", True)
+    assert [post(client, "a", f"a{n}").status_code for n in range(3)] == [200, 200, 200]
+    assert [post(client, "b", f"b{n}").status_code for n in range(3)] == [200, 200, 429]
+
+
+def test_oversized_body_is_rejected(client, admission):
+    body = order_body(student_name="x" * (65 * 1024))
+    response = client.post("/api/orders/simple", json=body)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+
+
+def test_each_idempotency_key_is_charged_once(client, admission):
+    # Retries of a stored order are replays and cost nothing
+    assert {post(client, "a", "same").status_code for _ in range(5)} == {200}
+
+    # A checkout's fallback attempts share one key: one token for the whole chain
+    invalid = {"client_key": "b", "grade": "x"}
+    for _ in range(2):
+        assert client.post("/api/orders", json=invalid, headers={"Idempotency-Key": "chain"}).status_code == 422
+    assert post(client, "b", "chain", path="/api/orders/simple").status_code == 200
+    assert [post(client, "b", f"b{n}").status_code for n in range(3)] == [200, 200, 429]
+
+
+def test_store_is_asked_only_when_the_bucket_refuses(client, store, admission, monkeypatch):
+    lookups = []
+    claimed = store.orders.idempotency_key_claimed
+
+    async def counted(key):
+        lookups.append(key)
+        return await claimed(key)
+
+    monkeypatch.setattr(store.orders, "idempotency_key_claimed", counted)
+    assert post(client, "a", "stored").status_code == 200
+    assert lookups == []
+
+    # Another worker: empty local state, client_key bucket exhausted
+    admission.charged_keys.clear()
+    for _ in range(3):
+        admission.take_token(["ck:a"])
+    assert post(client, "a", "stored").status_code == 200
+    assert post(client, "a", "fresh").status_code == 429
+    assert lookups == ["stored", "fresh"]
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import server
+from tests.conftest import GRADE, list_all
+
+
+def seed_archive(client, store) -> int:
+    now = datetime.utcnow()
+
+    def order(index, status, age_days):
+        created_at = now - timedelta(days=age_days)
+        return {
+            "id": f"o{index}", "student_name": f"s{index}", "grade": GRADE, "purchase_type": "all",
+            "status": status, "created_at": created_at, "client_key": "ck",
+            "confirmed_at": created_at if status == "confirmed" else None,
+            "total_amount": 50, "card_numbers": [f"99{index}"], "selected_subjects": [],
+        }
+
+    async def seed():
+        for item in [order(0, "confirmed", 200), order(1, "rejected", 150), order(2, "pending", 300),
+                     order(3, "confirmed", 10), order(4, "rejected", 120)]:
+            await store.orders.insert(item)
+        await server.rebuild_order_stats(store)
+        return await server.archive_settled_orders(store)
+
+    return client.portal.call(seed)
+
+
+def test_archived_orders_are_merged_and_still_writable(client, store):
+    assert seed_archive(client, store) == 3
+
+    assert [order["id"] for order in client.get("/api/orders").json()["orders"]] == ["o3", "o2"]
+    merged = ["o3", "o4", "o1", "o0", "o2"]
+    assert list_all(client, include_archived="true") == merged
+    assert list_all(client, include_archived="true", limit=2) == merged
+    assert [order["id"] for order in client.get("/api/orders/by-client/ck").json()] == merged
+
+    assert client.get("/api/orders/o0").json()["status"] == "confirmed"
+    updated = client.put("/api/orders/o1", json={"status": "pending"})
+    assert updated.status_code == 200 and updated.json()["status"] == "pending"
+    assert client.get("/api/orders/o1").json()["status"] == "pending"
+    assert client.delete("/api/orders/o4").status_code == 200
+    assert client.get("/api/orders/o4").status_code == 404
+    assert client.get("/api/stats").json()["total"] == {"count": 4, "revenue": 200}
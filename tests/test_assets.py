@@ -0,0 +1,83 @@
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from server import byte_range
+from tests.conftest import GRADE
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=-", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=10-19", (10, 19)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-500", (90, 99)),
+    ("bytes=-5", (95, 99)),
+    ("bytes=-500", (0, 99)),
+])
+def test_byte_range(header, expected):
+    assert byte_range(header, 100) == expected
+
+
+def test_unsatisfiable_byte_range():
+    with pytest.raises(HTTPException) as raised:
+        byte_range("bytes=100-", 100)
+    assert raised.value.status_code == 416
+    assert raised.value.headers == {"Content-Range": "bytes */100"}
+
+
+def png(color) -> bytes:
+    data = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(data, "PNG")
+    return data.getvalue()
+
+
+@pytest.fixture
+def asset_url(client):
+    subject = client.post("/api/subjects", json={"name": "فن", "grade": GRADE}).json()
+    response = client.post(f"/api/subjects/{subject['id']}/images", files=[("files", ("a.png", png((200, 10, 10)), "image/png"))])
+    assert response.status_code == 200, response.text
+    return response.json()["image_urls"][0]
+
+
+def test_asset_ranges_honour_if_range(client, asset_url):
+    full = client.get(asset_url)
+    assert full.status_code == 200 and full.headers["accept-ranges"] == "bytes"
+    etag, size = full.headers["etag"], len(full.content)
+
+    partial = client.get(asset_url, headers={"Range": "bytes=10-19", "If-Range": etag})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 10-19/{size}"
+    assert partial.content == full.content[10:20]
+
+    assert client.get(asset_url, headers={"Range": "bytes=-5"}).content == full.content[-5:]
+    # A changed representation (stale validator) gets the whole file
+    stale = client.get(asset_url, headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.content == full.content
+    assert client.get(asset_url, headers={"Range": f"bytes={size}-"}).status_code == 416
+    assert client.get(asset_url, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_variants_are_resized_jpegs_with_immutable_caching(client, asset_url):
+    data = io.BytesIO()
+    Image.new("RGBA", (1600, 800), (10, 200, 10, 128)).save(data, "PNG")
+    subject = client.post("/api/subjects", json={"name": "رسم", "grade": GRADE}).json()
+    uploaded = client.post(f"/api/subjects/{subject['id']}/images", files=[("files", ("b.png", data.getvalue(), "image/png"))])
+    [url] = uploaded.json()["image_urls"]
+    digest = url.rsplit("/", 1)[1].split(".")[0]
+
+    thumb = client.get(f"/api/assets/{digest}/thumb.jpg")
+    assert thumb.status_code == 200 and thumb.headers["content-type"] == "image/jpeg"
+    assert "immutable" in thumb.headers["cache-control"]
+    with Image.open(io.BytesIO(thumb.content)) as image:
+        assert (image.format, image.size) == ("JPEG", (320, 160))
+    assert client.get(f"/api/assets/{digest}/huge.jpg").status_code == 404
+
+    # Uploading the same bytes again reuses the stored asset
+    again = client.post(f"/api/subjects/{subject['id']}/images", files=[("files", ("a.png", png((200, 10, 10)), "image/png"))])
+    assert again.json()["image_urls"] == [url, asset_url]
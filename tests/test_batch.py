@@ -0,0 +1,22 @@
+from tests.conftest import GRADE, order_body
+
+
+def test_batch_creates_valid_orders_and_reports_the_rest(client):
+    items = [
+        order_body(student_name="علي", card_numbers=["١١١١ ٢٢٢٢"]),
+        order_body(grade="bad grade"),
+        {"grade": GRADE},
+        order_body(student_name="حسن", card_numbers=None, card_number="3333,1111-2222"),
+    ]
+    response = client.post("/api/orders/batch", json={"orders": items, "source": "مكتبة"})
+    body = response.json()
+
+    assert response.status_code == 200
+    assert (body["created"], body["invalid"], body["failed"]) == (2, 2, 0)
+    assert [item["result"] for item in body["results"]] == ["created", "invalid", "invalid", "created"]
+    assert body["results"][2]["error"] == "student_name: Field required"
+    created = [item["id"] for item in body["results"] if item["result"] == "created"]
+    last = client.get(f"/api/orders/{created[1]}").json()
+    assert last["card_numbers"] == ["3333", "11112222"]
+    assert last["duplicate_of"] == [created[0]]
+    assert client.post("/api/orders/batch", json={"orders": []}).status_code == 422
@@ -0,0 +1,15 @@
+from tests.conftest import create_orders
+
+
+def test_bulk_update_reports_each_order(client):
+    ids = create_orders(client, 3)
+
+    response = client.post("/api/orders/bulk", json={"order_ids": [*ids[:2], "missing"], "status": "confirmed"}).json()
+    assert response["matched"] == 2 and response["not_found"] == 1
+    assert [item["result"] for item in response["results"]] == ["updated", "updated", "not_found"]
+
+    deleted = client.post("/api/orders/bulk", json={"order_ids": ids[2:], "delete": True}).json()
+    assert deleted["results"] == [{"id": ids[2], "result": "deleted"}]
+    assert client.post("/api/orders/bulk", json={"order_ids": ids[:1]}).status_code == 400
+    assert [order["status"] for order in client.get("/api/orders").json()["orders"]] == ["confirmed", "confirmed"]
+    assert client.get("/api/stats").json()["by_status"] == {"confirmed": {"count": 2, "revenue": 100}}
@@ -0,0 +1,89 @@
+import pytest
+
+import server
+from tests.conftest import GRADE, notifications, order_body, sent_payloads, settled, wait_until
+
+pytestmark = pytest.mark.usefixtures("fast_backoff")
+
+
+def confirmed_order(client, store, telegram_stub, image_count: int) -> dict:
+    subject = client.post("/api/subjects", json={
+        "name": "فيزياء", "grade": GRADE, "image_urls": [f"http://img/{index}.jpg" for index in range(image_count)],
+    }).json()
+    order = client.post("/api/orders", json=order_body(
+        purchase_type="single", selected_subjects=[subject["id"]], contact_method="telegram", contact_value="12345",
+    )).json()
+    # The new-order notification goes out first, so scripted replies reach the fulfillment
+    wait_until(lambda: settled(store))
+    return order
+
+
+def fulfillment(client, order_id: str) -> dict:
+    job = client.get(f"/api/orders/{order_id}/fulfillment").json()
+    return job if job["status"] in ("done", "failed") else None
+
+
+def test_fulfillment_sends_subject_images_in_media_groups(client, store, telegram_stub):
+    order = confirmed_order(client, store, telegram_stub, 12)
+    telegram_stub.reset()
+    assert client.put(f"/api/orders/{order['id']}", json={"status": "confirmed"}).status_code == 200
+
+    job = wait_until(lambda: fulfillment(client, order["id"]))
+    assert (job["status"], job["sent_batches"], job["total_batches"]) == ("done", 2, 2)
+    groups = sent_payloads(telegram_stub, "sendMediaGroup")
+    assert [len(group["media"]) for group in groups] == [10, 2]
+    assert {group["chat_id"] for group in groups} == {"12345"}
+    assert groups[0]["media"][0]["caption"].startswith("فيزياء")
+    # Confirming again doesn't send the images twice
+    client.put(f"/api/orders/{order['id']}", json={"status": "confirmed"})
+    assert client.post(f"/api/orders/{order['id']}/fulfillment/retry").status_code == 409
+
+
+def test_fulfillment_resumes_after_rate_limit(client, store, telegram_stub):
+    order = confirmed_order(client, store, telegram_stub, 12)
+    telegram_stub.reset()
+    telegram_stub.script = [(200, {"ok": True, "result": []}), (429, {"ok": False, "parameters": {"retry_after": 1}})]
+    client.put(f"/api/orders/{order['id']}", json={"status": "confirmed"})
+
+    job = wait_until(lambda: fulfillment(client, order["id"]))
+    assert (job["status"], job["attempts"], job["sent_batches"]) == ("done", 0, 2)
+    # First batch once, second batch rate limited then resent
+    assert [len(group["media"]) for group in sent_payloads(telegram_stub, "sendMediaGroup")] == [10, 2, 2]
+
+
+def test_rejected_fulfillment_can_be_retried(client, store, telegram_stub):
+    order = confirmed_order(client, store, telegram_stub, 3)
+    telegram_stub.reset()
+    telegram_stub.script = [(400, {"ok": False, "description": "bad url"})]
+    client.put(f"/api/orders/{order['id']}", json={"status": "confirmed"})
+
+    job = wait_until(lambda: fulfillment(client, order["id"]))
+    assert (job["status"], job["sent_batches"]) == ("failed", 0)
+    assert job["last_error"].startswith("400")
+
+    assert client.post(f"/api/orders/{order['id']}/fulfillment/retry").status_code == 200
+    wait_until(lambda: client.get(f"/api/orders/{order['id']}/fulfillment").json()["status"] == "done")
+
+
+def test_bulk_confirmation_enqueues_fulfillments_in_one_write(client, store, telegram_stub, monkeypatch):
+    first = confirmed_order(client, store, telegram_stub, 2)
+    second = client.post("/api/orders", json=order_body(purchase_type="single", selected_subjects=first["selected_subjects"])).json()
+    wait_until(lambda: len(notifications(store)) == 2 and settled(store))
+    # A job from an earlier confirmation is kept, not duplicated
+    client.portal.call(server.enqueue_fulfillment, store, first["id"], "12345")
+    wait_until(lambda: fulfillment(client, first["id"]))
+
+    writes = []
+    create_many = store.fulfillments.create_many
+
+    async def counted(jobs):
+        created = await create_many(jobs)
+        writes.append(([job["order_id"] for job in jobs], created))
+        return created
+
+    monkeypatch.setattr(store.fulfillments, "create_many", counted)
+    client.post("/api/orders/bulk", json={"order_ids": [first["id"], second["id"]], "status": "confirmed"})
+
+    assert writes == [([first["id"], second["id"]], 1)]
+    assert wait_until(lambda: fulfillment(client, second["id"]))["status"] == "done"
+    assert client.portal.call(store.fulfillments.create_many, []) == 0
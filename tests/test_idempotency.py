@@ -0,0 +1,21 @@
+from tests.conftest import order_body
+
+
+def test_idempotency_key_replays_the_stored_order(client):
+    headers = {"Idempotency-Key": "submit-1"}
+    first = client.post("/api/orders", json=order_body(), headers=headers).json()
+    again = client.post("/api/orders", json=order_body(student_name="changed"), headers=headers).json()
+    simple = client.post("/api/orders/simple", json=order_body(), headers=headers).json()
+
+    assert again["id"] == simple["order"]["id"] == first["id"]
+    assert again["student_name"] == first["student_name"]
+    assert len(client.get("/api/orders").json()["orders"]) == 1
+
+
+def test_idempotency_key_in_progress_conflicts(client, store):
+    # Claimed by a request that hasn't stored its order yet
+    client.portal.call(store.orders.claim_idempotency_key, "submit-2", "not-stored-yet")
+
+    response = client.post("/api/orders", json=order_body(), headers={"Idempotency-Key": "submit-2"})
+    assert response.status_code == 409
+    assert client.get("/api/orders").json()["orders"] == []
@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+from server import OrderEventHub
+
+
+def events(queue: asyncio.Queue) -> list:
+    messages = []
+    while not queue.empty():
+        _, event, data = queue.get_nowait().strip().split("\n")
+        messages.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return messages
+
+
+def test_change_stream_events_carry_only_listed_fields():
+    hub = OrderEventHub()
+    queue = hub.subscribe()
+    document = {
+        "_id": "oid", "id": "o1", "student_name": "علي", "status": "pending", "client_key": "ck",
+        "card_numbers": ["123456789012"], "card_numbers_masked": ["•••• 9012"], "search_keys": ["علي"],
+    }
+
+    hub.publish_change({"operationType": "insert", "fullDocument": dict(document)})
+    hub.publish_change({
+        "operationType": "update", "fullDocument": dict(document),
+        "updateDescription": {"updatedFields": {"status": "confirmed", "card_numbers.0": "1", "search_keys": []}},
+    })
+    hub.publish_change({"operationType": "replace", "fullDocument": dict(document)})
+
+    (_, created), (_, updated), (_, replaced) = events(queue)
+    assert created["id"] == "o1" and created["card_numbers_masked"] == ["•••• 9012"]
+    for data in (created, replaced):
+        assert not {"_id", "card_numbers", "search_keys"} & set(data)
+    assert updated == {"status": "confirmed", "id": "o1"}
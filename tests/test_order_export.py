@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from tests.conftest import create_orders
+
+
+@pytest.mark.parametrize("bound", ["2020-01-01T00:00:00+03:00", "2020-01-01T00:00:00Z", "2020-01-01T00:00:00"])
+def test_export_date_filters_accept_aware_and_naive_datetimes(client, bound):
+    create_orders(client, 2)
+
+    exported = client.get("/api/orders/export", params={"created_from": bound, "format": "csv"})
+    assert exported.status_code == 200 and len(exported.text.splitlines()) == 3
+
+
+def test_ndjson_export_streams_one_order_per_line(client):
+    ids = create_orders(client, 3)
+    client.put(f"/api/orders/{ids[0]}", json={"status": "confirmed"})
+
+    exported = client.get("/api/orders/export", params={"order_status": "pending"})
+    assert exported.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in exported.text.splitlines()]
+    assert sorted(row["id"] for row in rows) == sorted(ids[1:])
+    assert all("search_keys" not in row and row["card_numbers"] for row in rows)
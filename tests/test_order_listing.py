@@ -0,0 +1,34 @@
+import pytest
+
+from tests.conftest import create_orders, list_all
+
+
+def test_keyset_pagination_walks_every_order_once(client):
+    ids = create_orders(client, 7)
+
+    first = client.get("/api/orders", params={"limit": 3}).json()
+    assert len(first["orders"]) == 3 and first["next_cursor"]
+    assert "card_numbers" not in first["orders"][0]
+
+    assert list_all(client, limit=3) == ids[::-1]
+
+
+def test_pagination_keeps_the_status_filter(client):
+    ids = create_orders(client, 5)
+    for order_id in ids[1::2]:
+        client.put(f"/api/orders/{order_id}", json={"status": "confirmed"})
+
+    assert list_all(client, limit=1, order_status="confirmed") == ids[1::2][::-1]
+
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get("/api/orders", params={"cursor": "zz"}).status_code == 400
+
+
+@pytest.mark.parametrize("bound", ["2020-01-01T00:00:00+03:00", "2020-01-01T00:00:00Z", "2020-01-01T00:00:00"])
+def test_date_filters_accept_aware_and_naive_datetimes(client, bound):
+    create_orders(client, 2)
+
+    listed = client.get("/api/orders", params={"created_from": bound, "created_to": "2999-01-01T00:00:00+00:00"})
+    assert listed.status_code == 200 and len(listed.json()["orders"]) == 2
+    assert client.get("/api/orders", params={"created_to": bound}).json()["orders"] == []
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.conftest import notifications, order_body, sent_payloads, settled, wait_until
+
+pytestmark = pytest.mark.usefixtures("fast_backoff")
+
+
+def test_outbox_sends_new_orders(client, store, telegram_stub):
+    order = client.post("/api/orders", json=order_body(student_name="علي")).json()
+
+    [notification] = wait_until(lambda: settled(store))
+    assert notification["status"] == "sent"
+    [message] = sent_payloads(telegram_stub, "sendMessage")
+    assert message["chat_id"] == "1000"
+    assert "علي" in message["text"] and order["id"] in message["text"]
+
+
+def test_outbox_waits_out_rate_limits_without_spending_attempts(client, store, telegram_stub):
+    telegram_stub.script = [(429, {"ok": False, "parameters": {"retry_after": 1}})]
+    client.post("/api/orders", json=order_body())
+
+    [notification] = wait_until(lambda: settled(store))
+    assert notification["status"] == "sent"
+    assert notification["attempts"] == 0
+    assert len(sent_payloads(telegram_stub, "sendMessage")) == 2
+
+
+def test_outbox_retries_server_errors_and_drops_rejections(client, store, telegram_stub):
+    telegram_stub.script = [(500, {"ok": False}), (400, {"ok": False, "description": "chat not found"})]
+    client.post("/api/orders", json=order_body(student_name="first"))
+    wait_until(lambda: settled(store))
+    first = notifications(store)[0]
+    # The 500 is retried, the retry's 400 is final
+    assert (first["status"], first["attempts"]) == ("failed", 2)
+    assert first["last_error"].startswith("400")
+
+    client.post("/api/orders", json=order_body(student_name="second"))
+    wait_until(lambda: len(notifications(store)) == 2 and settled(store))
+    assert [item["status"] for item in notifications(store)] == ["failed", "sent"]
+
+
+def test_settled_notifications_expire(client, store, telegram_stub):
+    telegram_stub.script = [(400, {"ok": False})]
+    client.post("/api/orders", json=order_body(student_name="first"))
+    wait_until(lambda: settled(store))
+    client.post("/api/orders", json=order_body(student_name="second"))
+    wait_until(lambda: len(notifications(store)) == 2 and settled(store))
+    assert all(item["completed_at"] for item in notifications(store))
+
+    store.notifications.retention = timedelta(0)
+    # Card numbers in the message text don't outlive the retention period
+    assert client.portal.call(store.notifications.claim_due, datetime.utcnow(), datetime.utcnow()) is None
+    assert notifications(store) == []
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import server
+from tests.conftest import GRADE, order_body, wait_until
+
+
+def test_search_normalizes_arabic_and_phone_numbers(client):
+    client.post("/api/orders", json=order_body(
+        student_name="أحمد عليّ", telegram_username="@Ahmed_99", phone_number="+964 770-123 4567",
+    ))
+    client.post("/api/orders", json=order_body(student_name="مريم", email="Mariam@Example.com"))
+
+    def search(query):
+        return [order["student_name"] for order in client.get("/api/orders/search", params={"q": query}).json()["orders"]]
+
+    for query in ["احمد", "اَحْمَد على", "ahmed", "@AHM", "07701234567", "7701234", "٠٧٧٠١٢٣٤٥٦٧"]:
+        assert search(query) == ["أحمد عليّ"], query
+    assert search("mariam@ex") == ["مريم"]
+    assert search("nothing") == []
+    assert client.get("/api/orders/search", params={"q": ""}).status_code == 422
+
+
+def test_search_key_backfill_only_touches_stale_orders(client, store):
+    async def legacy():
+        await store.orders.insert({
+            "id": "legacy", "student_name": "فاطمة", "grade": GRADE, "purchase_type": "all",
+            "status": "pending", "created_at": datetime(2020, 1, 1), "total_amount": 50,
+        })
+
+    client.post("/api/orders", json=order_body())
+    client.portal.call(legacy)
+
+    assert client.portal.call(server.backfill_search_keys, store) == 1
+    assert client.portal.call(server.backfill_search_keys, store) == 0
+    assert [order["id"] for order in client.get("/api/orders/search", params={"q": "فاطمه"}).json()["orders"]] == ["legacy"]
+
+
+def test_search_keys_are_checked_once_per_version(client, store, monkeypatch):
+    wait_until(lambda: store.meta.values.get("search_keys"))
+    scans = []
+
+    async def backfill(store):
+        scans.append(store)
+        return 0
+
+    monkeypatch.setattr(server, "backfill_search_keys", backfill)
+
+    client.portal.call(server.ensure_search_keys, store)
+    assert scans == []
+    monkeypatch.setattr(server, "SEARCH_KEYS_VERSION", server.SEARCH_KEYS_VERSION + 1)
+    client.portal.call(server.ensure_search_keys, store)
+    client.portal.call(server.ensure_search_keys, store)
+    assert scans == [store]
@@ -0,0 +1,17 @@
+from tests.conftest import GRADE
+
+
+def test_subject_names_are_unique_per_grade(client):
+    physics = client.post("/api/subjects", json={"name": "فيزياء", "grade": GRADE}).json()
+    chemistry = client.post("/api/subjects", json={"name": "كيمياء", "grade": GRADE}).json()
+
+    duplicate = client.post("/api/subjects", json={"name": "فيزياء", "grade": GRADE})
+    assert duplicate.status_code == 409
+    assert client.post("/api/subjects", json={"name": "فيزياء", "grade": "السادس ابتدائي"}).status_code == 200
+
+    renamed = client.put(f"/api/subjects/{chemistry['id']}", json={"name": "فيزياء", "grade": GRADE})
+    assert renamed.status_code == 409
+    # Saving a subject under its own name isn't a collision
+    assert client.put(f"/api/subjects/{physics['id']}", json={"name": "فيزياء", "grade": GRADE}).status_code == 200
+    names = [subject["name"] for subject in client.get(f"/api/subjects/{GRADE}").json()]
+    assert names.count("فيزياء") == 1 and "كيمياء" in names
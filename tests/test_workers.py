@@ -0,0 +1,36 @@
+import asyncio
+
+from server import BackgroundWorker
+
+
+class Worker(BackgroundWorker):
+    def __init__(self):
+        super().__init__(poll_interval=60)
+        self.rounds = 0
+        self.busy = asyncio.Event()
+
+    async def run_once(self):
+        self.rounds += 1
+        if self.rounds == 2:
+            self.busy.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                # What asyncio.wait_for does before Python 3.12 when it finishes as it's cancelled
+                pass
+
+
+def test_wake_runs_a_round_and_stop_ends_the_loop(store):
+    async def scenario():
+        worker = Worker()
+        await worker.start(store)
+        await asyncio.sleep(0)
+        assert worker.rounds == 1
+
+        worker.wake()
+        await asyncio.wait_for(worker.busy.wait(), 1)
+        # The swallowed cancellation doesn't keep the loop alive
+        await asyncio.wait_for(worker.stop(), 1)
+        assert worker.rounds == 2 and worker.tasks == []
+
+    asyncio.run(scenario())